@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+
+# Offline benchmark of the serving stack. MaskRCNN and TensorFlow are replaced by a fake backend that
+# returns synthetic detections, so the numbers measure the API overhead (decode, tiling, contours,
+# shape classifier, serialization) without weights or a GPU.
+#
+#   python benchmark.py --targets app,route --inputs base64,url --instances 1,20,200 \
+#       --sizes 1024,4096,8192 --split off,on --requests 20 --output bench.json
+#
+# Every scenario reports throughput, p50/p99 latency and the peak RSS seen while it ran. With
+# --baseline the results are compared with a previous output and the script exits with 1 when a
+# scenario got slower than --tolerance.
+
+import os
+import sys
+import json
+import time
+import types
+import pickle
+import shutil
+import base64
+import logging
+import argparse
+import platform
+import tempfile
+import warnings
+import threading
+import subprocess
+import http.server
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+import numpy as np
+import psutil
+
+
+MODEL_NAME = "bench"
+CLASS_NAMES = ["BG", "object", "other"]
+
+
+class FakeConfig:
+
+    def __init__(self, images_per_gpu: int, name: str, num_classes: int, class_names: list):
+        self.NAME = name
+        self.IMAGES_PER_GPU = images_per_gpu
+        self.GPU_COUNT = 1
+        self.BATCH_SIZE = images_per_gpu
+        self.NUM_CLASSES = num_classes
+        self.CLASS_NAMES = class_names
+        self.IMAGE_MIN_DIM = 64
+
+
+class FakeKerasModel:
+
+    def count_params(self):
+        return 0
+
+
+class FakeMaskRCNN:
+    # Detections are built once per image shape and reused, building 8k masks on every call would
+    # measure numpy instead of the API
+    instances = 1
+    detect_time = 0.0
+    _results = {}
+    _lock = threading.Lock()
+
+    def __init__(self, mode: str, config: FakeConfig, model_dir: str):
+        self.mode = mode
+        self.config = config
+        self.model_dir = model_dir
+        self.keras_model = FakeKerasModel()
+
+    def load_weights(self, filepath: str, by_name: bool = False):
+        pass
+
+    def detect(self, images: list, verbose=0) -> list:
+        if self.detect_time:
+            time.sleep(self.detect_time)
+
+        return [self._get_result(image.shape[:2]) for image in images]
+
+    @classmethod
+    def _get_result(cls, shape) -> dict:
+        key = (shape, cls.instances)
+        with cls._lock:
+            if key not in cls._results:
+                cls._results.clear()
+                cls._results[key] = build_detections(shape, cls.instances)
+
+            return cls._results[key]
+
+
+def build_detections(shape, instances: int) -> dict:
+    height, width = shape
+    rng = np.random.default_rng(instances)
+    size = max(min(height, width) // 8, 4)
+    masks = np.zeros((height, width, instances), dtype=bool)
+    rois = np.zeros((instances, 4), dtype=np.int32)
+    for i in range(instances):
+        y1 = int(rng.integers(0, max(height - size, 1)))
+        x1 = int(rng.integers(0, max(width - size, 1)))
+        y2, x2 = min(y1 + size, height), min(x1 + size, width)
+        rois[i] = [y1, x1, y2, x2]
+        center = ((x1 + x2) // 2, (y1 + y2) // 2)
+        ellipse = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+        cv.ellipse(ellipse, (center[0] - x1, center[1] - y1), ((x2 - x1) // 2, (y2 - y1) // 3), 30, 0, 360, 1, -1)
+        masks[y1:y2, x1:x2, i] = ellipse.astype(bool)
+
+    return {
+        "rois": rois,
+        "class_ids": rng.integers(1, len(CLASS_NAMES), instances).astype(np.int32),
+        "scores": rng.uniform(0.7, 1.0, instances).astype(np.float32),
+        "masks": masks,
+    }
+
+
+def install_fake_backend():
+    mrcnn = types.ModuleType("mrcnn")
+    mrcnn_model = types.ModuleType("mrcnn.model")
+    mrcnn_configs = types.ModuleType("mrcnn.Configs")
+    mrcnn_model.MaskRCNN = FakeMaskRCNN
+    mrcnn_configs.Config = FakeConfig
+    mrcnn.model = mrcnn_model
+    mrcnn.Configs = mrcnn_configs
+
+    tensorflow = types.ModuleType("tensorflow")
+    tensorflow.keras = types.SimpleNamespace(backend=types.SimpleNamespace(clear_session=lambda: None))
+
+    sys.modules.update({
+        "mrcnn": mrcnn,
+        "mrcnn.model": mrcnn_model,
+        "mrcnn.Configs": mrcnn_configs,
+        "tensorflow": tensorflow,
+    })
+
+
+def write_config(work_dir: str, shape_classifier: bool):
+    config = {
+        "weights": [],
+        "modelsConfig": [{
+            "name": MODEL_NAME,
+            "imagesPerGpu": 1,
+            "numClasses": len(CLASS_NAMES),
+            "weights": "bench.h5",
+            "classNames": CLASS_NAMES,
+        }],
+        "extra": {},
+    }
+    if shape_classifier:
+        from sklearn.ensemble import AdaBoostClassifier
+
+        rng = np.random.default_rng(0)
+        classifier = AdaBoostClassifier(n_estimators=50).fit(rng.normal(size=(200, 13)), rng.integers(0, 2, 200))
+        os.makedirs(os.path.join(work_dir, "logs", "weights"), exist_ok=True)
+        with open(os.path.join(work_dir, "logs", "weights", "bench_shape.pkl"), "wb") as f:
+            pickle.dump(classifier, f)
+        config["extra"][MODEL_NAME] = {
+            "name": "ShapeClassifier",
+            "weights": "bench_shape.pkl",
+            "classes": ["Regular", "Irregular"],
+        }
+
+    with open(os.path.join(work_dir, "config.json"), "w") as f:
+        json.dump(config, f)
+
+
+def build_image(size: int) -> bytes:
+    image = np.zeros((size, size, 3), dtype=np.uint8)
+    image[:] = np.linspace(0, 255, size, dtype=np.uint8)[None, :, None]
+    for i in range(0, size, max(size // 16, 1)):
+        cv.circle(image, (i, (i * 7) % size), max(size // 20, 2), (255, 80, 40), -1)
+
+    return cv.imencode(".jpg", image, [cv.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def start_image_server(images: dict):
+    class ImageRequestHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Without it the body waits for the delayed ACK of the headers and every URL costs 40ms
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            body = images.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ImageRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class PeakRSSSampler:
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self.running = False
+        self.thread = None
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self.running = True
+        self.thread = threading.Thread(target=self._sample)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.thread.join()
+
+    def _sample(self):
+        while self.running:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+
+class Benchmark:
+
+    def __init__(self, args):
+        self.args = args
+        self.work_dir = tempfile.mkdtemp(prefix="maskrcnn-bench-")
+        self.log_dir = os.path.join(self.work_dir, "logs", "bench")
+        os.makedirs(self.log_dir)
+        os.makedirs(os.path.join(self.work_dir, "images"))
+        write_config(self.work_dir, args.shape_classifier)
+
+        os.environ.update({
+            "RESULT_CACHE_BACKEND": "none",
+            "JOB_WORKERS": "0",
+            "BATCH_WINDOW_TIME": "0",
+            "ARCHIVE_IMAGES": "0",
+            "TILE_SIZE": str(args.tile_size),
+        })
+        install_fake_backend()
+        os.chdir(self.work_dir)
+
+        from src.app import APIServer
+
+        self.api_server = APIServer(worker_name="bench", log_dir=self.log_dir)
+        self.api_server.logger.setLevel(getattr(logging, args.log_level))
+        self.route = self.api_server.inference_route
+        self.local = threading.local()
+
+        self.images = {size: build_image(size) for size in args.sizes}
+        self.image_server = start_image_server({f"/{size}.jpg": image for size, image in self.images.items()})
+        FakeMaskRCNN.detect_time = args.detect_time
+
+    def run(self) -> list:
+        results = []
+        for target in self.args.targets:
+            for input_type in self.args.inputs:
+                for instances in self.args.instances:
+                    for size in self.args.sizes:
+                        for split in self.args.split:
+                            if target == "handler" and (instances != self.args.instances[0] or split != self.args.split[0]):
+                                continue
+
+                            result = self.run_scenario(target, input_type, instances, size, split)
+                            results.append(result)
+                            print(json.dumps(result), file=sys.stderr)
+
+        return results
+
+    def run_scenario(self, target: str, input_type: str, instances: int, size: int, split: str) -> dict:
+        scenario = {
+            "name": f"{target}/{input_type}/{instances}/{size}/{split}",
+            "target": target,
+            "input": input_type,
+            "instances": instances,
+            "size": size,
+            "split": split,
+        }
+        detect_size = min(size, self.args.tile_size) if split == "on" else size
+        if target != "handler" and detect_size * detect_size * instances > self.args.max_mask_bytes:
+            return {**scenario, "skipped": "masks bigger than --max-mask-bytes"}
+
+        FakeMaskRCNN.instances = instances
+        self.api_server.api_config.split_images_above_maximum = split == "on"
+        if input_type == "url":
+            image_data = "http://127.0.0.1:{}/{}.jpg".format(self.image_server.server_port, size)
+        else:
+            image_data = "data:image/jpeg;base64," + base64.b64encode(self.images[size]).decode()
+        body = {"image": image_data, "classes": [CLASS_NAMES[1]], "maskFormat": self.args.mask_format}
+        call = self._get_call(target, body)
+
+        for _ in range(self.args.warmup):
+            call()
+
+        latencies = []
+        errors = 0
+
+        def timed_call(_):
+            start_time = time.perf_counter()
+            try:
+                call()
+                return time.perf_counter() - start_time, None
+            except Exception as ex:
+                return time.perf_counter() - start_time, ex
+
+        with PeakRSSSampler() as sampler:
+            start_time = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+                for latency, error in executor.map(timed_call, range(self.args.requests)):
+                    latencies.append(latency)
+                    if error is not None:
+                        errors += 1
+                        if errors == 1:
+                            logging.getLogger("benchmark").warning(f"{scenario['name']} failed: {error!r}")
+            elapsed = time.perf_counter() - start_time
+
+        latencies = np.array(latencies) * 1000
+        return {
+            **scenario,
+            "requests": self.args.requests,
+            "concurrency": self.args.concurrency,
+            "errors": errors,
+            "throughput_rps": round(self.args.requests / elapsed, 3),
+            "latency_ms": {
+                "p50": round(float(np.percentile(latencies, 50)), 3),
+                "p99": round(float(np.percentile(latencies, 99)), 3),
+                "mean": round(float(latencies.mean()), 3),
+            },
+            "peak_rss_mb": round(sampler.peak / (1024 * 1024), 1),
+        }
+
+    def _get_call(self, target: str, body: dict):
+        if target == "handler":
+            return lambda: self.route.image_handler.get_image(body)
+        if target == "route":
+            return lambda: self.route.process(dict(body))
+
+        payload = json.dumps(body)
+
+        def post():
+            client = getattr(self.local, "client", None)
+            if client is None:
+                client = self.local.client = self.api_server.app.test_client()
+            response = client.post("/inference", data=payload, content_type="application/json")
+            if response.status_code != 200:
+                raise Exception(f"/inference replied {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+        return post
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    with open(baseline_path, "r") as f:
+        baseline = {item["name"]: item for item in json.load(f)["scenarios"] if "latency_ms" in item}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["name"])
+        if previous is None or "latency_ms" not in result:
+            continue
+
+        for metric in ("p50", "p99"):
+            before, after = previous["latency_ms"][metric], result["latency_ms"][metric]
+            if before and after > before * (1 + tolerance):
+                regressions.append({"name": result["name"], "metric": metric, "baseline": before, "current": after})
+
+    return regressions
+
+
+def get_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_list(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the MaskRCNN API with a fake model backend")
+    parser.add_argument("--targets", type=parse_list(str), default=["app", "route", "handler"],
+                        help="app (Flask /inference), route (MaskRCNNInferenceRoute) and handler (ImageServiceHandler)")
+    parser.add_argument("--inputs", type=parse_list(str), default=["base64", "url"])
+    parser.add_argument("--instances", type=parse_list(int), default=[1, 20, 200])
+    parser.add_argument("--sizes", type=parse_list(int), default=[1024, 4096, 8192])
+    parser.add_argument("--split", type=parse_list(str), default=["off", "on"])
+    parser.add_argument("--mask-format", default="polygon", choices=["polygon", "rle", "bitmap"])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--detect-time", type=float, default=0.0, help="seconds the fake detect sleeps per call")
+    parser.add_argument("--max-mask-bytes", type=int, default=2 * 1024 * 1024 * 1024,
+                        help="scenarios whose masks of one detect call are bigger are skipped")
+    parser.add_argument("--shape-classifier", action="store_true", help="run a ShapeClassifier on every instance")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="file for the JSON results, stdout when missing")
+    parser.add_argument("--baseline", help="previous JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed latency growth over the baseline")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # The benchmark runs inside a temporary directory with its own config.json
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.baseline = os.path.abspath(args.baseline) if args.baseline else None
+    logging.basicConfig(level=logging.WARNING)
+    warnings.filterwarnings("ignore", category=FutureWarning)
+
+    benchmark = Benchmark(args)
+    try:
+        results = benchmark.run()
+    finally:
+        shutil.rmtree(benchmark.work_dir, ignore_errors=True)
+    output = {
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "maskFormat": args.mask_format,
+        "shapeClassifier": args.shape_classifier,
+        "scenarios": results,
+    }
+    if args.baseline:
+        output["regressions"] = compare(results, args.baseline, args.tolerance)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if output.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
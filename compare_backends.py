@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+
+# Accuracy against latency of the inference backends on CPU. The same images go through every
+# backend of one model of config.json, the detections are matched with the ones of the keras
+# backend by class and mask IoU. Run it from the directory with config.json and logs/weights.
+#
+#   python compare_backends.py --model coco --images ./images \
+#       --backends keras,savedmodel,onnx:fp32,onnx:fp16,onnx:int8 --runs 5 --output compare.json
+#
+# Every backend reports its load time (the export is included the first time), p50/p95 latency per
+# image, and recall, precision, mean mask IoU and mean score difference against keras.
+
+import os
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import warnings
+
+# TensorFlow must not see a GPU, the numbers are for the CPU only nodes
+os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
+
+import cv2 as cv
+import numpy as np
+
+from benchmark import get_revision, parse_list
+
+
+def parse_backend(value: str) -> dict:
+    name, _, precision = value.partition(":")
+    return {"backend": name, "precision": precision or "fp32"}
+
+
+def load_images(images_dir: str, limit: int) -> list:
+    images = []
+    for file_name in sorted(os.listdir(images_dir)):
+        image = cv.imread(os.path.join(images_dir, file_name))
+        if image is None:
+            continue
+        images.append((file_name, cv.cvtColor(image, cv.COLOR_BGR2RGB)))
+        if len(images) >= limit:
+            break
+
+    return images
+
+
+def build_model(item: dict, backend_config: dict, log_dir: str):
+    from mrcnn.Configs import Config
+    from src.models import ModelWrapper
+
+    # One image per call, so the latency is per image whatever imagesPerGpu the server uses
+    config = Config(
+        images_per_gpu=1,
+        name=item["name"],
+        num_classes=item["numClasses"],
+        class_names=item["classNames"],
+    )
+    model = ModelWrapper(mode="inference", config=config, model_dir=log_dir, backend_config=backend_config)
+    model.load_weights(filepath="logs/weights/{}".format(item["weights"]), by_name=True)
+    return model
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> float:
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 0.0
+
+
+def match(reference: dict, candidate: dict, iou_threshold: float) -> dict:
+    # Greedy matching from the most confident reference detection, like the COCO evaluation
+    matched = []
+    used = set()
+    for i in np.argsort(-reference["scores"]):
+        best, best_iou = None, iou_threshold
+        for j in range(len(candidate["class_ids"])):
+            if j in used or candidate["class_ids"][j] != reference["class_ids"][i]:
+                continue
+            iou = mask_iou(reference["masks"][:, :, i], candidate["masks"][:, :, j])
+            if iou >= best_iou:
+                best, best_iou = j, iou
+        if best is not None:
+            used.add(best)
+            matched.append((best_iou, abs(float(reference["scores"][i]) - float(candidate["scores"][best]))))
+
+    return {
+        "reference": len(reference["class_ids"]),
+        "candidate": len(candidate["class_ids"]),
+        "matched": len(matched),
+        "iou": [iou for iou, _ in matched],
+        "scoreDelta": [delta for _, delta in matched],
+    }
+
+
+def run_backend(item: dict, backend_config: dict, images: list, args) -> tuple:
+    import tensorflow as tf
+
+    start_time = time.perf_counter()
+    model = build_model(item, backend_config, args.log_dir)
+    load_time = time.perf_counter() - start_time
+    model.warm_up()
+
+    latencies = []
+    detections = []
+    for _, image in images:
+        for run in range(args.runs):
+            start_time = time.perf_counter()
+            result = model.detect([image])[0]
+            latencies.append(time.perf_counter() - start_time)
+            if run == 0:
+                detections.append(result)
+
+    model.release()
+    tf.keras.backend.clear_session()
+    gc.collect()
+
+    return {
+        "loadTime": round(load_time, 3),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)) * 1000, 3),
+            "p95": round(float(np.percentile(latencies, 95)) * 1000, 3),
+            "mean": round(float(np.mean(latencies)) * 1000, 3),
+        },
+    }, detections
+
+
+def summarize(matches: list) -> dict:
+    reference = sum([item["reference"] for item in matches])
+    candidate = sum([item["candidate"] for item in matches])
+    matched = sum([item["matched"] for item in matches])
+    ious = [iou for item in matches for iou in item["iou"]]
+    deltas = [delta for item in matches for delta in item["scoreDelta"]]
+    return {
+        "recall": round(matched / reference, 4) if reference else 1.0,
+        "precision": round(matched / candidate, 4) if candidate else 1.0,
+        "meanMaskIoU": round(float(np.mean(ious)), 4) if ious else None,
+        "meanScoreDelta": round(float(np.mean(deltas)), 4) if deltas else None,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare accuracy and CPU latency of the inference backends")
+    parser.add_argument("--model", required=True, help="name of the model in config.json modelsConfig")
+    parser.add_argument("--images", required=True, help="directory with the images to run")
+    parser.add_argument("--limit", type=int, default=20, help="maximum number of images")
+    parser.add_argument("--backends", type=parse_list(parse_backend),
+                        default=[parse_backend(value) for value in ("keras", "savedmodel", "onnx:fp32", "onnx:fp16", "onnx:int8")],
+                        help="backend[:precision] list, keras always runs first as the reference")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs per image")
+    parser.add_argument("--threads", type=int, default=0, help="intra op threads of the onnx backend, 0 for the default")
+    parser.add_argument("--iou", type=float, default=0.5, help="mask IoU for a detection to match the reference")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--log-dir", default="logs/compare")
+    parser.add_argument("--output", help="file for the JSON results, stdout when missing")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    logging.basicConfig(level=logging.WARNING)
+    warnings.filterwarnings("ignore", category=FutureWarning)
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    from src.models import ModelWrapper
+
+    with open(args.config, "r") as f:
+        items = {item["name"]: item for item in json.load(f)["modelsConfig"]}
+    if args.model not in items:
+        sys.exit(f"There is no model {args.model} in {args.config}")
+    images = load_images(args.images, args.limit)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+
+    backends = [parse_backend("keras")] + [item for item in args.backends if item["backend"] != "keras"]
+    for backend_config in backends:
+        backend_config["threads"] = args.threads
+        ModelWrapper.validate_backend(backend_config)
+
+    results = []
+    reference = None
+    for backend_config in backends:
+        name = "{}:{}".format(backend_config["backend"], backend_config["precision"])
+        try:
+            result, detections = run_backend(items[args.model], backend_config, images, args)
+        except Exception as ex:
+            # Without the keras reference there is nothing to compare with
+            if reference is None:
+                raise
+            results.append({"backend": name, "error": str(ex)})
+            continue
+
+        if reference is None:
+            reference = detections
+        result["accuracy"] = summarize([
+            match(expected, actual, args.iou) for expected, actual in zip(reference, detections)
+        ])
+        result["speedup"] = round(results[0]["latency_ms"]["p50"] / result["latency_ms"]["p50"], 3) if results else 1.0
+        results.append({"backend": name, **result})
+
+    output = {
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "model": args.model,
+        "images": len(images),
+        "runs": args.runs,
+        "backends": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+
+if __name__ == "__main__":
+    main()
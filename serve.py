@@ -12,14 +12,16 @@
 # ---------                --------------------              -------------
 # number of workers        MODEL_SERVER_WORKERS              the number of CPU cores
 # timeout                  MODEL_SERVER_TIMEOUT              60 seconds
+# worker class             SERVER_WORKER_CLASS               sync (gthread when SERVER_THREADS > 1)
+# threads per worker       SERVER_THREADS                    1
+# inference servers        INFERENCE_SERVERS                 0 (every worker loads its own models)
+# parallel downloads       WEIGHTS_DOWNLOAD_WORKERS          4
+# worker heartbeats        WORKER_HEARTBEAT_INTERVAL         5 seconds, dead after 3 missed
 
 import os
 import signal
 import subprocess
-import requests
-import urllib.request
 import logging
-import shutil
 import sys
 import json
 import socket
@@ -28,7 +30,8 @@ import threading
 import multiprocessing
 from dotenv import load_dotenv
 
-from src.services import MemoryCleanService, ZMQServer
+from src.services import MemoryCleanService, ZMQServer, InferenceServer, WeightsDownloader
+from src.models import MetricsRegistry
 
 
 random.seed(74642620)
@@ -39,6 +42,9 @@ cpu_count = multiprocessing.cpu_count()
 
 model_server_timeout = os.environ.get('SERVER_TIMEOUT', 60)
 model_server_workers = int(os.environ.get('SERVER_WORKERS', cpu_count))
+inference_servers = int(os.environ.get('INFERENCE_SERVERS', 0))
+model_server_threads = int(os.environ.get('SERVER_THREADS', 1))
+model_server_worker_class = os.environ.get('SERVER_WORKER_CLASS', 'gthread' if model_server_threads > 1 else 'sync')
 adjs = [
     "Saltitante", "Cansado", "Risonho", "Berrante", "Trombadinha", "Zangado", "Pulante",
     "Fedorento", "Chorão", "Avexado", "Atrevido", "Careca", "Calvo", "Apressado",
@@ -86,7 +92,14 @@ def sigterm_handler(nginx_pid, gunicorn_pid):
     sys.exit(0)
 
 def start_server():
-    logger.info('Starting the inference server with {} workers.'.format(model_server_workers))
+    logger.info('Starting the inference server with {} {} workers and {} threads each.'.format(
+        model_server_workers, model_server_worker_class, model_server_threads
+    ))
+
+    # Model servers own the MaskRCNN instances, gunicorn workers forward images to them over ZMQ
+    model_servers = [InferenceServer(index, logger) for index in range(inference_servers)]
+    for model_server in model_servers:
+        model_server.start()
 
     # link the log streams to stdout/err so they will be logged to the container logs
     subprocess.check_call(['ln', '-sf', '/dev/stdout', '/var/log/nginx/access.log'])
@@ -95,7 +108,8 @@ def start_server():
     nginx = subprocess.Popen(['nginx', '-c', '/app/nginx.conf'])
     gunicorn = subprocess.Popen(['gunicorn',
                                  '--timeout', str(model_server_timeout),
-                                 '-k', 'sync',
+                                 '-k', model_server_worker_class,
+                                 '--threads', str(model_server_threads),
                                  '-b', 'unix:/tmp/gunicorn.sock',
                                  '-w', str(model_server_workers),
                                  'wsgi:app'])
@@ -105,14 +119,30 @@ def start_server():
     # Exit the inference server upon exit of either subprocess
     memory_cleaner = None
     if bool(int(os.environ.get("USE_CLEAN_SERVICE", 0))):
+        # Reported with the workers metrics on /metrics
+        os.makedirs(os.path.join("/app/logs", "memoryCleaner"), exist_ok=True)
+        metrics = MetricsRegistry(
+            worker_name="memoryCleaner",
+            log_dir=os.path.join("/app/logs", "memoryCleaner"),
+            flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", 5)),
+        )
+        metrics.start()
         memory_cleaner = MemoryCleanService(
             images_dir="/app/images",
             max_file_size=float(os.environ.get("FILES_MAX_SIZE", 0.5)),
             clean_time_window=float(os.environ.get("CLEAN_WINDOW_TIME", 60 * 30)),
+            check_interval=float(os.environ.get("CLEAN_CHECK_INTERVAL", 5)),
+            high_watermark=float(os.environ.get("CLEAN_HIGH_WATERMARK", 0.9)),
+            low_watermark=float(os.environ.get("CLEAN_LOW_WATERMARK", 0.7)),
+            max_deletes_per_second=float(os.environ.get("CLEAN_MAX_DELETES_PER_SECOND", 100)),
+            metrics=metrics,
         )
         memory_cleaner.start()
     
-    zmq_server = ZMQServer(logger=logger)
+    zmq_server = ZMQServer(
+        logger=logger,
+        heartbeat_timeout=3 * float(os.environ.get("WORKER_HEARTBEAT_INTERVAL", 5)),
+    )
     zmq_server.start()
 
     pids = set([nginx.pid, gunicorn.pid])
@@ -122,6 +152,8 @@ def start_server():
             break
     
     zmq_server.stop()
+    for model_server in model_servers:
+        model_server.stop()
     if memory_cleaner is not None:
         memory_cleaner.stop()
     
@@ -140,44 +172,15 @@ def download_dependencies():
     if not os.path.exists("./images"):
         os.system("mkdir images")
 
-    total = len(config["weights"])
-    for index, weight in enumerate(config["weights"]):
-        logger.info("Starting to download {} [{}/{}]".format(weight["name"], index + 1, total))
-        file_path = os.path.join("logs", "weights", "{}.{}".format(weight["name"], weight["fileType"]))
-        
-        if os.path.exists(file_path):
-            logger.info("Weight already downloaded it, skipping...")
-            continue
-        try:
-            if weight.get("requestType", "fileTransfer") == "fileTransfer":
-                download_file(weight["url"], file_path)
-            elif weight["requestType"] == "signedRequest":
-                logger.info("Url pre assigned found, sending request to get file url")
-                url = request_file_url(weight["url"])
-                download_file(url, file_path)
-            logger.info("{} weight downloaded! [{}/{}]".format(weight["name"], index + 1, total))
-        except Exception as ex:
-            logger.exception(ex)
-    
-    logger.info("All weights downloaded!")
-    
-    logger.info("All weights downloaded!")
-
-
-def download_file(url, file_path):
-    with urllib.request.urlopen(url) as resp, open(file_path, 'wb') as out:
-        shutil.copyfileobj(resp, out)
-
-
-def request_file_url(signed_url):
-    response = requests.get(signed_url)
-    if response.status_code == 200:
-        logger.info("Weights file url got successfully, starting download")
-        data = json.loads(response.content.decode())
-        
-        return data["body"]
-    
-    raise Exception(f"Invalid url {signed_url}, replied with status code {response.status_code}")
+    downloader = WeightsDownloader(
+        logger=logger,
+        weights_dir=os.path.join("logs", "weights"),
+        max_workers=int(os.environ.get("WEIGHTS_DOWNLOAD_WORKERS", 4)),
+    )
+    if downloader.download_all(config["weights"]):
+        logger.info("All weights downloaded!")
+    else:
+        logger.error("Some weights couldn't be downloaded, check the errors above")
 
 
 def get_cool_name():
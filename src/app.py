@@ -1,16 +1,23 @@
 import os
 import json
+import atexit
+import psutil
 import logging
+import datetime
+import threading
 from flask_cors import CORS, cross_origin
 from flask_swagger_ui import get_swaggerui_blueprint
-from flask import Flask, request, send_from_directory
+from flask import Flask, Response, request, send_from_directory
 from dotenv import load_dotenv
 
-from .utils import handle_exception
-from .models import ModelCache, APIConfig
-from .routes import MaskRCNNInferenceRoute, MaskRCNNGetClassesRoute, ConfigRoute, GetWorkersRoute, BlockRoute
-from .handlers import BlockSystemHandler
-from .services import ZMQClient
+from .utils import handle_exception, negotiate_content
+from .models import ModelCache, APIConfig, InferenceCache, JobQueue, MetricsRegistry
+from .routes import (
+    MaskRCNNInferenceRoute, MaskRCNNGetClassesRoute, ConfigRoute, GetWorkersRoute, BlockRoute, ModelCacheStatsRoute,
+    JobsRoute, MetricsRoute, ProfileRoute, ReloadRoute
+)
+from .handlers import BlockSystemHandler, ModelReloadHandler
+from .services import ZMQClient, InferenceClient, InferenceServer, JobService, SamplingProfiler, WeightsDownloader
 
 
 # docker image build -t maskrcnn:latest .
@@ -28,42 +35,148 @@ class APIServer:
         self.port = os.environ.get("SERVER_PORT", 8080)
         
         self.worker_name = worker_name
+        self.created_at = datetime.datetime.now()
+        self.requests_count = 0
+        self.requests_in_flight = 0
+        self._requests_lock = threading.Lock()
         self._write_pid(log_dir)
-        self.api_config = APIConfig(
-            approx_epsilon=4,
-            log_dir=log_dir,
-            images_dir="./images",
-            max_instances_model=int(os.environ.get("MODEL_MAX_QTY", 1)),
-            split_images_above_maximum=bool(int(os.environ.get("SPLIT_IMAGES_ABOVE_MAXIMUM", 0)))
-        )
+        self.api_config = APIConfig.from_environ(log_dir=log_dir, images_dir="./images")
 
         self.logger = self._build_logger(log_dir)
-        self.model_cache = ModelCache(self.logger, self.api_config)
+        self.metrics = MetricsRegistry(
+            worker_name=self.worker_name,
+            log_dir=log_dir,
+            flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", 5)),
+        )
+        self.model_cache = ModelCache(self.logger, self.api_config, self._build_inference_client(), self.metrics)
+        self.metrics.add_collector(self.model_cache.get_metrics)
+        self.inference_cache = InferenceCache(
+            backend=os.environ.get("RESULT_CACHE_BACKEND", "memory"),
+            max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+            ttl=float(os.environ.get("RESULT_CACHE_TTL", 60 * 10)),
+            db_path=os.environ.get("RESULT_CACHE_PATH", os.path.join(log_dir, "..", "inference_cache.db")),
+        )
+        self.job_queue = JobQueue(
+            db_path=os.environ.get("JOBS_PATH", os.path.join(log_dir, "..", "jobs.db")),
+            lease_time=float(os.environ.get("JOB_LEASE_TIME", 60 * 10)),
+            max_attempts=int(os.environ.get("JOB_MAX_ATTEMPTS", 3)),
+            result_ttl=float(os.environ.get("JOB_RESULT_TTL", 60 * 60 * 24)),
+        )
         self.block_system_handler = BlockSystemHandler(self.model_cache)
+        self.reload_handler = ModelReloadHandler(self.model_cache, self.logger)
         self.zmq_client = ZMQClient(
             worker_name=self.worker_name,
             block_system=self.block_system_handler,
-            logger=self.logger
+            logger=self.logger,
+            profiler=SamplingProfiler(
+                log_dir=log_dir,
+                logger=self.logger,
+                interval=float(os.environ.get("PROFILE_INTERVAL", 0.01)),
+                max_seconds=float(os.environ.get("PROFILE_MAX_SECONDS", 300)),
+            ),
+            stats_provider=self.get_worker_stats,
+            heartbeat_interval=float(os.environ.get("WORKER_HEARTBEAT_INTERVAL", 5)),
+            reload_handler=self.reload_handler,
         )
 
-        self.inference_route = MaskRCNNInferenceRoute(self.logger, self.api_config)
+        self.inference_route = MaskRCNNInferenceRoute(
+            self.logger,
+            self.api_config,
+            self.model_cache,
+            self.inference_cache,
+            self.metrics,
+        )
         self.config_route = ConfigRoute(self.api_config, self.logger)
         self.get_classes_route = MaskRCNNGetClassesRoute(self.model_cache)
-        self.get_workers_route = GetWorkersRoute(self.api_config.log_dir)
+        self.get_workers_route = GetWorkersRoute(zmq_client=self.zmq_client, logger=self.logger)
         self.block_route = BlockRoute(zmq_client=self.zmq_client, logger=self.logger)
+        self.model_cache_stats_route = ModelCacheStatsRoute(self.model_cache)
+        self.job_service = JobService(
+            logger=self.logger,
+            job_queue=self.job_queue,
+            process=self.inference_route.process,
+            workers=int(os.environ.get("JOB_WORKERS", 1)),
+            poll_interval=float(os.environ.get("JOB_POLL_INTERVAL", 1)),
+        )
+        self.jobs_route = JobsRoute(self.logger, self.job_queue, self.job_service, self.inference_route)
+        self.metrics_route = MetricsRoute(self.metrics)
+        self.profile_route = ProfileRoute(zmq_client=self.zmq_client, logger=self.logger)
+        self.reload_route = ReloadRoute(
+            logger=self.logger,
+            zmq_client=self.zmq_client,
+            model_cache=self.model_cache,
+            reload_handler=self.reload_handler,
+            downloader=WeightsDownloader(
+                logger=self.logger,
+                weights_dir=os.path.join("logs", "weights"),
+                max_workers=1,
+            ),
+        )
 
+        self.app.before_request(self._start_request)
+        self.app.teardown_request(self._end_request)
         self.app.route("/inference", methods=["POST"])(self.inference)
+        self.app.route("/inference/upload", methods=["POST"])(self.inference_upload)
+        self.app.route("/inference/batch", methods=["POST"])(self.inference_batch)
         self.app.route("/classes", methods=["GET"])(self.get_classes)
         self.app.route("/updateConfig", methods=["PUT"])(self.update_config)
         self.app.route("/workers", methods=["GET"])(self.get_workers)
         self.app.route("/block", methods=["POST"])(self.block_system)
+        self.app.route("/cache", methods=["GET"])(self.get_cache_stats)
+        self.app.route("/jobs", methods=["POST"])(self.create_job)
+        self.app.route("/jobs/<job_id>", methods=["GET"])(self.get_job)
+        self.app.route("/metrics", methods=["GET"])(self.get_metrics)
+        self.app.route("/profile", methods=["POST"])(self.profile)
+        self.app.route("/reload", methods=["POST"])(self.create_reload)
+        self.app.route("/reload/<reload_id>", methods=["GET"])(self.get_reload)
         self.app.route("/static/<path:path>")(self.get_static)
         self.app.register_blueprint(
             self._get_swagger_blueprint(),
             url_prefix="/doc"
         )
+        self.model_cache.preload_models()
         self.logger.info(f"{self.worker_name} is ready listening on port {str(self.port)}")
         self.zmq_client.start_listen()
+        self.job_service.start()
+        self.metrics.start()
+        atexit.register(self.inference_route.close)
+    
+    def _build_inference_client(self):
+        # With dedicated inference servers the workers only forward images, the models live there
+        inference_servers = int(os.environ.get("INFERENCE_SERVERS", 0))
+        if inference_servers <= 0:
+            return None
+        
+        return InferenceClient(
+            addresses=[InferenceServer.get_address(index) for index in range(inference_servers)],
+            logger=self.logger,
+            timeout=float(os.environ.get("INFERENCE_SERVER_TIMEOUT", 60)),
+        )
+    
+    def get_worker_stats(self) -> dict:
+        with self._requests_lock:
+            requests_count, requests_in_flight = self.requests_count, self.requests_in_flight
+        
+        return {
+            "status": "blocked" if not self.model_cache.models_config else "running",
+            "pid": os.getpid(),
+            "createdAt": self.created_at.isoformat(),
+            "timeRunning": str(datetime.datetime.now() - self.created_at),
+            "memUsage": psutil.Process().memory_info().rss / (1024 * 1024),
+            "models": [model["name"] for model in self.model_cache.get_stats()["models"]],
+            "weights": dict(self.model_cache.weights),
+            "requestsInFlight": requests_in_flight,
+            "requests": requests_count,
+        }
+    
+    def _start_request(self):
+        with self._requests_lock:
+            self.requests_count += 1
+            self.requests_in_flight += 1
+    
+    def _end_request(self, exception=None):
+        with self._requests_lock:
+            self.requests_in_flight -= 1
     
     def _write_pid(self, log_dir: str):
         with open(os.path.join(log_dir, "pid"), "w") as f:
@@ -101,11 +214,55 @@ class APIServer:
         self.app.run(host="0.0.0.0", port=self.port, debug=False)
 
     @cross_origin()
+    @negotiate_content()
     @handle_exception()
     def inference(self):
-        data = json.loads(request.data)
-        model = self.model_cache.get_model_based_on_data(data)
-        return self.inference_route.process(data, model)
+        with self.metrics.time("parse"):
+            data = json.loads(request.data)
+        return self.inference_route.process(data)
+    
+    @cross_origin()
+    @negotiate_content()
+    @handle_exception()
+    def inference_upload(self):
+        with self.metrics.time("parse"):
+            data, image_buffer, content_type = self._parse_upload_request()
+        return self.inference_route.process_upload(data, image_buffer, content_type)
+    
+    @cross_origin()
+    @handle_exception()
+    def inference_batch(self):
+        with self.metrics.time("parse"):
+            data = json.loads(request.data)
+        lines = self.inference_route.process_batch(data)
+        # nginx must not buffer the stream or the client only sees the results at the end
+        return Response(lines, mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+    
+    def _parse_upload_request(self):
+        # Multipart and raw uploads carry the classes as form fields, query parameters or the
+        # X-Classes header, in that order
+        upload = request.files.get("image")
+        if upload is not None:
+            image_buffer = upload.read()
+            content_type = upload.mimetype
+        else:
+            image_buffer = request.get_data()
+            content_type = request.mimetype
+        classes = request.form.getlist("classes") or request.args.getlist("classes") or \
+            [request.headers.get("X-Classes", "")]
+
+        classes = [
+            class_name.strip()
+            for item in classes
+            for class_name in item.split(",")
+            if class_name.strip()
+        ]
+        data = {"classes": classes}
+        mask_format = request.values.get("maskFormat") or request.headers.get("X-Mask-Format")
+        if mask_format:
+            data["maskFormat"] = mask_format
+        
+        return data, image_buffer, content_type
     
     @cross_origin()
     @handle_exception()
@@ -128,6 +285,44 @@ class APIServer:
     def block_system(self):
         return self.block_route.process()
     
+    @cross_origin()
+    @handle_exception()
+    def get_cache_stats(self):
+        return self.model_cache_stats_route.process()
+    
+    @cross_origin()
+    @handle_exception(success_code=202)
+    def create_job(self):
+        data = json.loads(request.data)
+        return self.jobs_route.create(data)
+    
+    @cross_origin()
+    @handle_exception()
+    def get_job(self, job_id):
+        return self.jobs_route.get(job_id)
+    
+    @cross_origin()
+    @handle_exception()
+    def get_metrics(self):
+        return Response(self.metrics_route.process(), mimetype="text/plain; version=0.0.4")
+    
+    @cross_origin()
+    @handle_exception(success_code=202)
+    def profile(self):
+        data = json.loads(request.data) if request.data else {}
+        return self.profile_route.process(data)
+    
+    @cross_origin()
+    @handle_exception(success_code=202)
+    def create_reload(self):
+        data = json.loads(request.data)
+        return self.reload_route.create(data)
+    
+    @cross_origin()
+    @handle_exception()
+    def get_reload(self, reload_id):
+        return self.reload_route.get(reload_id)
+    
     @cross_origin()
     @handle_exception()
     def get_static(self, path):
@@ -0,0 +1,92 @@
+import time
+import requests
+from logging import Logger
+from typing import Any, Callable, List, Tuple
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from ..exceptions import UnprocessableRequest, BadRequestException
+
+
+class ImageFetcher:
+    CHUNK_SIZE = 64 * 1024
+    SIGNATURES = (
+        (b"\xff\xd8\xff", "jpeg"),
+        (b"\x89PNG\r\n\x1a\n", "png"),
+        (b"GIF87a", "gif"),
+        (b"GIF89a", "gif"),
+        (b"BM", "bmp"),
+        (b"II*\x00", "tiff"),
+        (b"MM\x00*", "tiff"),
+    )
+
+    def __init__(
+            self,
+            logger: Logger,
+            connect_timeout: float = 3,
+            read_timeout: float = 10,
+            max_bytes: int = 20 * 1024 * 1024,
+            pool_size: int = 10,
+            max_workers: int = 4
+    ):
+        self.logger = logger
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_bytes = max_bytes
+        # One keep-alive pool per host, reused by every request of the worker
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ImageFetcher")
+
+    def fetch(self, url: str) -> Tuple[bytes, str]:
+        # The read timeout only bounds each socket read, a server dripping bytes is cut by the deadline
+        deadline = time.monotonic() + sum(self.timeout)
+        try:
+            with self.session.get(url, stream=True, timeout=self.timeout) as response:
+                if response.status_code != 200:
+                    raise UnprocessableRequest(f"URL replied with status code {response.status_code}")
+
+                content_length = response.headers.get("Content-Length")
+                if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+                    raise UnprocessableRequest(f"Image from url {url} is bigger than {self.max_bytes} bytes")
+
+                buffer = bytearray()
+                for chunk in response.iter_content(self.CHUNK_SIZE):
+                    buffer.extend(chunk)
+                    if len(buffer) > self.max_bytes:
+                        raise UnprocessableRequest(f"Image from url {url} is bigger than {self.max_bytes} bytes")
+                    if time.monotonic() > deadline:
+                        raise requests.Timeout()
+        except requests.Timeout:
+            raise UnprocessableRequest(f"Timeout while downloading image from url {url}")
+        except requests.RequestException:
+            raise UnprocessableRequest(f"Can't download image from url {url}")
+
+        # Servers often reply with a generic or wrong content type, the bytes are what gets decoded
+        image_type = self.sniff(buffer)
+        if image_type is None:
+            raise BadRequestException(f"URL {url} replied with a non image file")
+
+        return bytes(buffer), image_type
+
+    def prefetch(self, urls: List[str], decode: Callable[[bytes, str], Any]) -> List[Future]:
+        # The decoding runs on the pool too, the futures resolve to the decoded images
+        return [self.executor.submit(self._fetch_and_decode, url, decode) for url in urls]
+
+    def _fetch_and_decode(self, url: str, decode: Callable[[bytes, str], Any]):
+        return decode(*self.fetch(url))
+
+    def sniff(self, buffer) -> str:
+        header = bytes(buffer[:12])
+        for signature, image_type in self.SIGNATURES:
+            if header.startswith(signature):
+                return image_type
+        if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+            return "webp"
+
+        return None
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
@@ -1,92 +1,121 @@
 import os
 import uuid
 import base64
-import shutil
 import skimage
-import urllib.request
+import cv2 as cv
+import numpy as np
+from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor
 
-import skimage.transform
+import skimage.color
 
 from ..exceptions import UnprocessableRequest, BadRequestException
+from ._ImageFetcher import ImageFetcher
 
 
 class ImageServiceHandler:
 
-    def __init__(self, image_dir: str, logger):
+    def __init__(self, image_dir: str, logger, archive_images: bool = False, image_fetcher: ImageFetcher = None):
         self.image_dir = image_dir
         self.logger = logger
-    
+        self.archive_images = archive_images
+        self.image_fetcher = image_fetcher if image_fetcher is not None else ImageFetcher(logger)
+        self._archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ImageArchiver")
+
     def get_image(self, data: dict):
         image_data = data["image"]
         if image_data.startswith("data:image"):
             return self._parse_base64_image(image_data)
-        elif image_data.startswith("http://") or image_data.startswith("https://"):
+        elif self._is_url(image_data):
             return self._download_image(image_data)
-    
-    def _download_image(self, image_url: str):
-        response = urllib.request.urlopen(image_url)
-        if response.code != 200:
-            raise UnprocessableRequest(f"URL replied with status code {response.code}")
-        
-        file_extension = response.headers.get_content_type()
-        if not file_extension.startswith("image"):
-            raise BadRequestException(f"URL {image_url} replied with a non image file type {file_extension}")
-
-        file_name = str(uuid.uuid4())
-        file_extension = file_extension.replace("image/", "")
-        image_path = os.path.join(self.image_dir, f"{file_name}.{file_extension}")
-        self._lock_file(file_name)
-        try:
-            with open(image_path, 'wb') as out:
-                shutil.copyfileobj(response, out)
-        except:
-            self._unlock_file(file_name)
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            
-            raise UnprocessableRequest(f"Can't download image from url {image_url}")
-        
-        image = skimage.io.imread(image_path)
-        self._unlock_file(file_name)
+
+        raise BadRequestException("image must be a base64 data url or an http(s) url")
+
+    def get_images(self, images_data: List[str]) -> List[Future]:
+        # Every URL starts downloading right away on the fetcher pool, the futures resolve to the
+        # decoded images in the request order
+        urls = [(index, image_data) for index, image_data in enumerate(images_data)
+                if isinstance(image_data, str) and self._is_url(image_data)]
+        futures = dict(zip(
+            [index for index, _ in urls],
+            self.image_fetcher.prefetch([url for _, url in urls], self._decode_downloaded)
+        ))
+        for index, image_data in enumerate(images_data):
+            if index in futures:
+                continue
+            future = Future()
+            try:
+                future.set_result(self.get_image({"image": image_data}))
+            except Exception as ex:
+                future.set_exception(ex)
+            futures[index] = future
+
+        return [futures[index] for index in range(len(images_data))]
+
+    def get_uploaded_image(self, buffer: bytes, content_type: str):
+        if not buffer:
+            raise BadRequestException("no image found in request")
+
+        image = self.decode_image(buffer)
+        file_extension = content_type.replace("image/", "") if content_type.startswith("image/") else ""
+        self._archive_image(buffer, file_extension)
+        return image
+
+    def decode_image(self, buffer: bytes):
+        image = cv.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv.IMREAD_UNCHANGED)
+        if image is None:
+            raise UnprocessableRequest("Image can't be used, maybe is corrupted")
+
+        if image.ndim == 2:
+            return cv.cvtColor(image, cv.COLOR_GRAY2RGB)
         if image.shape[2] == 4:
-            image = skimage.color.rgba2rgb(image)
-        
+            return skimage.color.rgba2rgb(cv.cvtColor(image, cv.COLOR_BGRA2RGBA))
+
+        return cv.cvtColor(image, cv.COLOR_BGR2RGB)
+
+    def _is_url(self, image_data: str) -> bool:
+        return image_data.startswith("http://") or image_data.startswith("https://")
+
+    def _download_image(self, image_url: str):
+        return self._decode_downloaded(*self.image_fetcher.fetch(image_url))
+
+    def _decode_downloaded(self, buffer: bytes, image_type: str):
+        image = self.decode_image(buffer)
+        self._archive_image(buffer, image_type)
         return image
-    
-    def _lock_file(self, file_name: str):
-        with open(os.path.join(self.image_dir, file_name + ".lock"), "w") as f:
-            f.write("lock")
-    
-    def _unlock_file(self, file_name: str):
-        os.remove(os.path.join(self.image_dir, file_name + ".lock"))
-    
+
     def _parse_base64_image(self, image_data: str):
-        image_path = ""
         self.logger.info("Parsing base64 image...")
         try:
             file_ext, encoded_image = image_data.split(',')
 
             file_ext = file_ext.replace('data:image', '')
             file_ext = file_ext.replace(';base64', '')
-            file_name = str(uuid.uuid4()) + file_ext.replace("/", ".")
-            
-            self.logger.info(f"Saving new image {file_name}")
-            image_path = os.path.join(self.image_dir, file_name)
-            with open(image_path, 'wb') as f:
-                f.write(base64.b64decode(encoded_image))
-            
-            image = skimage.io.imread(image_path)
-            if image.shape[2] == 4:
-                image = skimage.color.rgba2rgb(image)
-            
-            return image
+            buffer = base64.b64decode(encoded_image)
         except ValueError:
             raise BadRequestException(
                  "The image data must be encoded in base64 with pattern data:filename/png;base64,image_base64_data"
             )
-        except Exception:
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            
-            raise UnprocessableRequest("Image can't be used, maybe is corrupted")
-    
\ No newline at end of file
+
+        image = self.decode_image(buffer)
+        self._archive_image(buffer, file_ext.replace("/", ""))
+        return image
+
+    def _archive_image(self, buffer: bytes, file_extension: str):
+        if not self.archive_images:
+            return
+
+        file_name = f"{uuid.uuid4()}.{file_extension}" if file_extension else str(uuid.uuid4())
+        self._archive_executor.submit(self._write_image, buffer, file_name)
+
+    def _write_image(self, buffer: bytes, file_name: str):
+        try:
+            self.logger.info(f"Saving new image {file_name}")
+            with open(os.path.join(self.image_dir, file_name), 'wb') as f:
+                f.write(buffer)
+        except Exception as ex:
+            self.logger.exception(ex)
+
+    def close(self):
+        self.image_fetcher.close()
+        self._archive_executor.shutdown(wait=True)
@@ -0,0 +1,129 @@
+import numpy as np
+
+from ..models import APIConfig
+
+
+class ImageTilingHandler:
+
+    def __init__(self, api_config: APIConfig):
+        self.api_config = api_config
+
+    def should_split(self, image) -> bool:
+        if not self.api_config.split_images_above_maximum:
+            return False
+
+        return image.shape[0] > self.api_config.tile_size or image.shape[1] > self.api_config.tile_size
+
+    def split(self, image) -> list:
+        height, width = image.shape[:2]
+        tile_size = self.api_config.tile_size
+        tiles = []
+        for y in self._get_tile_starts(height):
+            for x in self._get_tile_starts(width):
+                window = (y, x, min(y + tile_size, height), min(x + tile_size, width))
+                tiles.append((window, image[window[0]:window[2], window[1]:window[3]]))
+
+        return tiles
+
+    def merge(self, tiles: list, results: list) -> list:
+        detections = []
+        for (window, _), res in zip(tiles, results):
+            for i in range(len(res["class_ids"])):
+                y1, x1, y2, x2 = [int(value) for value in res["rois"][i]]
+                if y2 <= y1 or x2 <= x1:
+                    continue
+
+                bbox = [y1 + window[0], x1 + window[1], y2 + window[0], x2 + window[1]]
+                detections.append({
+                    "class_id": int(res["class_ids"][i]),
+                    "score": float(res["scores"][i]),
+                    "bbox": bbox,
+                    "mask": res["masks"][y1:y2, x1:x2, i],
+                    "offset": (bbox[0], bbox[1]),
+                    "windows": [window],
+                })
+
+        merged = []
+        for detection in sorted(detections, key=lambda item: item["score"], reverse=True):
+            for group in merged:
+                if self._is_same_object(group, detection):
+                    self._merge_detection(group, detection)
+                    break
+            else:
+                merged.append(detection)
+
+        return merged
+
+    def _get_tile_starts(self, length: int) -> list:
+        tile_size = self.api_config.tile_size
+        if length <= tile_size:
+            return [0]
+
+        stride = tile_size - self.api_config.tile_overlap
+        starts = list(range(0, length - tile_size, stride))
+        starts.append(length - tile_size)
+        return starts
+
+    def _is_same_object(self, group: dict, detection: dict) -> bool:
+        if group["class_id"] != detection["class_id"]:
+            return False
+        if self._intersect(group["bbox"], detection["bbox"]) is None:
+            return False
+
+        # Both tiles saw the same pixels inside their overlap, so the masks of an object cut by
+        # the seam must agree there even when the parts outside the overlap are very different
+        bbox_union = self._union(group["bbox"], detection["bbox"])
+        for group_window in group["windows"]:
+            for window in detection["windows"]:
+                if group_window == window:
+                    continue
+
+                region = self._intersect(group_window, window)
+                region = self._intersect(region, bbox_union) if region is not None else None
+                if region is None:
+                    continue
+
+                group_mask = self._crop_to_region(group, region)
+                detection_mask = self._crop_to_region(detection, region)
+                union = np.count_nonzero(group_mask | detection_mask)
+                if union and np.count_nonzero(group_mask & detection_mask) / union >= self.api_config.tile_merge_iou:
+                    return True
+
+        return False
+
+    def _merge_detection(self, group: dict, detection: dict):
+        bbox = self._union(group["bbox"], detection["bbox"])
+        mask = self._crop_to_region(group, bbox)
+        mask |= self._crop_to_region(detection, bbox)
+
+        group["bbox"] = bbox
+        group["mask"] = mask
+        group["offset"] = (bbox[0], bbox[1])
+        group["score"] = max(group["score"], detection["score"])
+        group["windows"].extend(detection["windows"])
+
+    def _crop_to_region(self, detection: dict, region) -> np.ndarray:
+        y1, x1, y2, x2 = region
+        crop = np.zeros((y2 - y1, x2 - x1), dtype=bool)
+        intersection = self._intersect(region, detection["bbox"])
+        if intersection is None:
+            return crop
+
+        iy1, ix1, iy2, ix2 = intersection
+        by1, bx1 = detection["bbox"][0], detection["bbox"][1]
+        crop[iy1 - y1:iy2 - y1, ix1 - x1:ix2 - x1] = detection["mask"][iy1 - by1:iy2 - by1, ix1 - bx1:ix2 - bx1]
+        return crop
+
+    def _intersect(self, first, second):
+        y1, x1 = max(first[0], second[0]), max(first[1], second[1])
+        y2, x2 = min(first[2], second[2]), min(first[3], second[3])
+        if y2 <= y1 or x2 <= x1:
+            return None
+
+        return [y1, x1, y2, x2]
+
+    def _union(self, first, second) -> list:
+        return [
+            min(first[0], second[0]), min(first[1], second[1]),
+            max(first[2], second[2]), max(first[3], second[3]),
+        ]
@@ -0,0 +1,40 @@
+import numpy as np
+
+from ..exceptions import BadRequestException
+
+
+class MaskFormatHandler:
+    FORMATS = ("polygon", "rle", "bitmap")
+
+    def get_mask_format(self, data: dict) -> str:
+        mask_format = data.get("maskFormat", "polygon")
+        if mask_format not in self.FORMATS:
+            raise BadRequestException(f"maskFormat {mask_format} not allowed, valid formats are {list(self.FORMATS)}")
+        
+        return mask_format
+
+    def encode(self, mask: np.ndarray, offset, bbox: list, mask_format: str) -> dict:
+        # Both formats describe the mask cropped to its bbox, placed at offset [y, x] of the image
+        crop = mask[bbox[0] - offset[0]:bbox[2] - offset[0], bbox[1] - offset[1]:bbox[3] - offset[1]] != 0
+        encoded = {
+            "format": mask_format,
+            "size": list(crop.shape),
+            "offset": [bbox[0], bbox[1]],
+        }
+        if mask_format == "rle":
+            encoded["counts"] = self._encode_rle(crop)
+        else:
+            # Raw bytes, the response serializer writes them as is with msgpack and in base64 with JSON
+            encoded["bits"] = np.packbits(crop, axis=None).tobytes()
+        
+        return encoded
+
+    def _encode_rle(self, crop: np.ndarray) -> list:
+        # COCO run-length encoding: column-major runs that always start counting zeros
+        pixels = crop.ravel(order="F")
+        changes = np.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+        counts = np.diff(np.concatenate(([0], changes, [pixels.size])))
+        if pixels.size and pixels[0]:
+            counts = np.concatenate(([0], counts))
+        
+        return counts.tolist()
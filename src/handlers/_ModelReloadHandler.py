@@ -0,0 +1,37 @@
+import os
+import json
+from logging import Logger
+
+from ..models import ModelCache
+
+
+class ModelReloadHandler:
+    CONFIG_PATH = "./config.json"
+
+    def __init__(self, model_cache: ModelCache, logger: Logger):
+        self.model_cache = model_cache
+        self.logger = logger
+
+    def reload(self, model_key: str, weights_file: str):
+        self.model_cache.reload_model(
+            model_key,
+            weights_file,
+            warm_up=self.model_cache.preload_config.get(model_key, True),
+        )
+
+    def save_config(self, model_key: str, weight: dict, weights_file: str):
+        # Workers started after the reload, like the ones gunicorn respawns, read the new weights
+        with open(self.CONFIG_PATH, "r") as f:
+            config = json.loads(f.read())
+
+        config["weights"] = [item for item in config.get("weights", []) if item["name"] != weight["name"]]
+        config["weights"].append(weight)
+        for item in config["modelsConfig"]:
+            if item["name"] == model_key:
+                item["weights"] = weights_file
+
+        tmp_path = self.CONFIG_PATH + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(config, f, indent=4)
+        os.replace(tmp_path, self.CONFIG_PATH)
+        self.logger.info(f"Config updated with weights {weights_file} for model {model_key}")
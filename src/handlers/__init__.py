@@ -1,2 +1,6 @@
 from ._ImageServiceHandler import ImageServiceHandler
 from ._BlockSystemHandler import BlockSystemHandler
+from ._ImageTilingHandler import ImageTilingHandler
+from ._MaskFormatHandler import MaskFormatHandler
+from ._ImageFetcher import ImageFetcher
+from ._ModelReloadHandler import ModelReloadHandler
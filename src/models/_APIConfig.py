@@ -1,3 +1,6 @@
+import os
+
+
 class APIConfig:
 
     def __init__(
@@ -6,14 +9,81 @@ class APIConfig:
             log_dir: str,
             images_dir: str,
             max_instances_model: int,
-            split_images_above_maximum: bool
+            split_images_above_maximum: bool,
+            batch_window_time: float,
+            model_wait_timeout: float,
+            model_queue_size: int,
+            model_queue_fifo: bool,
+            tile_size: int,
+            tile_overlap: int,
+            tile_merge_iou: float,
+            archive_images: bool,
+            model_memory_budget: int,
+            model_eviction_policy: str,
+            postprocess_workers: int,
+            image_fetch_connect_timeout: float,
+            image_fetch_read_timeout: float,
+            image_fetch_max_bytes: int,
+            image_fetch_pool_size: int,
+            image_fetch_workers: int
     ) -> None:
 
+        APIConfig.validate_tiling(tile_size, tile_overlap)
         self.approx_epsilon = approx_epsilon
         self.split_images_above_maximum = split_images_above_maximum
+        self.batch_window_time = batch_window_time
+        self.model_wait_timeout = model_wait_timeout
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_merge_iou = tile_merge_iou
         self._log_dir = log_dir
         self._images_dir = images_dir
         self._max_instances_model = max_instances_model
+        self._model_queue_size = model_queue_size
+        self._model_queue_fifo = model_queue_fifo
+        self._archive_images = archive_images
+        self._model_memory_budget = model_memory_budget
+        self._model_eviction_policy = model_eviction_policy
+        self._postprocess_workers = postprocess_workers
+        self._image_fetch_connect_timeout = image_fetch_connect_timeout
+        self._image_fetch_read_timeout = image_fetch_read_timeout
+        self._image_fetch_max_bytes = image_fetch_max_bytes
+        self._image_fetch_pool_size = image_fetch_pool_size
+        self._image_fetch_workers = image_fetch_workers
+    
+    @staticmethod
+    def from_environ(log_dir: str, images_dir: str):
+        return APIConfig(
+            approx_epsilon=4,
+            log_dir=log_dir,
+            images_dir=images_dir,
+            max_instances_model=int(os.environ.get("MODEL_MAX_QTY", 1)),
+            split_images_above_maximum=bool(int(os.environ.get("SPLIT_IMAGES_ABOVE_MAXIMUM", 0))),
+            batch_window_time=float(os.environ.get("BATCH_WINDOW_TIME", 0.01)),
+            model_wait_timeout=float(os.environ.get("MODEL_WAIT_TIMEOUT", 30)),
+            model_queue_size=int(os.environ.get("MODEL_QUEUE_SIZE", 16)),
+            model_queue_fifo=bool(int(os.environ.get("MODEL_QUEUE_FIFO", 1))),
+            tile_size=int(os.environ.get("TILE_SIZE", 1024)),
+            tile_overlap=int(os.environ.get("TILE_OVERLAP", 128)),
+            tile_merge_iou=float(os.environ.get("TILE_MERGE_IOU", 0.5)),
+            archive_images=bool(int(os.environ.get("ARCHIVE_IMAGES", 0))),
+            model_memory_budget=int(os.environ.get("MODEL_MEMORY_BUDGET", 0)),
+            model_eviction_policy=os.environ.get("MODEL_EVICTION_POLICY", "lru").lower(),
+            postprocess_workers=int(os.environ.get("POSTPROCESS_WORKERS", os.cpu_count() or 1)),
+            image_fetch_connect_timeout=float(os.environ.get("IMAGE_FETCH_CONNECT_TIMEOUT", 3)),
+            image_fetch_read_timeout=float(os.environ.get("IMAGE_FETCH_READ_TIMEOUT", 10)),
+            image_fetch_max_bytes=int(os.environ.get("IMAGE_FETCH_MAX_BYTES", 20 * 1024 * 1024)),
+            image_fetch_pool_size=int(os.environ.get("IMAGE_FETCH_POOL_SIZE", 10)),
+            image_fetch_workers=int(os.environ.get("IMAGE_FETCH_WORKERS", 4))
+        )
+    
+    @staticmethod
+    def validate_tiling(tile_size: int, tile_overlap: int):
+        # The tiles advance by tile_size - tile_overlap pixels, anything else never ends the image
+        if tile_size <= 0:
+            raise ValueError(f"TILE_SIZE must be positive, got {tile_size}")
+        if not 0 <= tile_overlap < tile_size:
+            raise ValueError(f"TILE_OVERLAP must be between 0 and TILE_SIZE - 1, got {tile_overlap} for TILE_SIZE {tile_size}")
     
     @property
     def images_dir(self):
@@ -27,6 +97,50 @@ class APIConfig:
     def max_instances_model(self):
         return self._max_instances_model
     
+    @property
+    def model_queue_size(self):
+        return self._model_queue_size
+    
+    @property
+    def model_queue_fifo(self):
+        return self._model_queue_fifo
+    
+    @property
+    def archive_images(self):
+        return self._archive_images
+    
+    @property
+    def model_memory_budget(self):
+        return self._model_memory_budget
+    
+    @property
+    def model_eviction_policy(self):
+        return self._model_eviction_policy
+    
+    @property
+    def postprocess_workers(self):
+        return self._postprocess_workers
+    
+    @property
+    def image_fetch_connect_timeout(self):
+        return self._image_fetch_connect_timeout
+    
+    @property
+    def image_fetch_read_timeout(self):
+        return self._image_fetch_read_timeout
+    
+    @property
+    def image_fetch_max_bytes(self):
+        return self._image_fetch_max_bytes
+    
+    @property
+    def image_fetch_pool_size(self):
+        return self._image_fetch_pool_size
+    
+    @property
+    def image_fetch_workers(self):
+        return self._image_fetch_workers
+    
     @max_instances_model.setter
     def max_instances_model(self, value):
         pass
@@ -38,3 +152,47 @@ class APIConfig:
     @images_dir.setter
     def images_dir(self, value):
         pass
+
+    @model_queue_size.setter
+    def model_queue_size(self, value):
+        pass
+
+    @model_queue_fifo.setter
+    def model_queue_fifo(self, value):
+        pass
+
+    @archive_images.setter
+    def archive_images(self, value):
+        pass
+
+    @model_memory_budget.setter
+    def model_memory_budget(self, value):
+        pass
+
+    @model_eviction_policy.setter
+    def model_eviction_policy(self, value):
+        pass
+
+    @postprocess_workers.setter
+    def postprocess_workers(self, value):
+        pass
+
+    @image_fetch_connect_timeout.setter
+    def image_fetch_connect_timeout(self, value):
+        pass
+
+    @image_fetch_read_timeout.setter
+    def image_fetch_read_timeout(self, value):
+        pass
+
+    @image_fetch_max_bytes.setter
+    def image_fetch_max_bytes(self, value):
+        pass
+
+    @image_fetch_pool_size.setter
+    def image_fetch_pool_size(self, value):
+        pass
+
+    @image_fetch_workers.setter
+    def image_fetch_workers(self, value):
+        pass
@@ -0,0 +1,153 @@
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+class InferenceCache:
+
+    def __init__(self, backend: str, max_bytes: int, ttl: float, db_path: str):
+        self.backend_name = backend
+        if backend == "none":
+            self.backend = None
+        elif backend == "memory":
+            self.backend = _MemoryBackend(max_bytes, ttl)
+        elif backend == "sqlite":
+            self.backend = _SQLiteBackend(db_path, max_bytes, ttl)
+        else:
+            raise ValueError(f"Invalid inference cache backend {backend}, valid backends are none, memory and sqlite")
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def build_key(self, image: np.ndarray, *params) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps([image.shape, str(image.dtype), *params], sort_keys=True).encode())
+        digest.update(memoryview(np.ascontiguousarray(image)).cast("B"))
+        return digest.hexdigest()
+
+    def get(self, key: str):
+        if self.backend is None:
+            return None
+
+        # pickle keeps the raw bytes of the bitmap masks, entries of an older format are misses
+        value = self.backend.get(key)
+        try:
+            return pickle.loads(value) if value is not None else None
+        except pickle.UnpicklingError:
+            return None
+
+    def put(self, key: str, data: dict):
+        if self.backend is not None:
+            self.backend.put(key, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class _MemoryBackend:
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            created_at, value = entry
+            if self.ttl and time.time() - created_at > self.ttl:
+                self._remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (time.time(), value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class _SQLiteBackend:
+
+    def __init__(self, db_path: str, max_bytes: int, ttl: float):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS inferences ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS inferences_accessed_at ON inferences (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads, and every gunicorn worker
+        # opens its own connections to the same file
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+
+        return conn
+
+    def get(self, key: str):
+        conn = self._connect()
+        with conn:
+            row = conn.execute("SELECT value, created_at FROM inferences WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            value, created_at = row
+            if self.ttl and time.time() - created_at > self.ttl:
+                conn.execute("DELETE FROM inferences WHERE key = ?", (key,))
+                return None
+
+            conn.execute("UPDATE inferences SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            return value
+
+    def put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO inferences (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+            if self.ttl:
+                conn.execute("DELETE FROM inferences WHERE created_at < ?", (now - self.ttl,))
+
+            size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM inferences").fetchone()[0]
+            while size > self.max_bytes:
+                rows = conn.execute("SELECT key, size FROM inferences ORDER BY accessed_at LIMIT 32").fetchall()
+                for row_key, row_size in rows:
+                    conn.execute("DELETE FROM inferences WHERE key = ?", (row_key,))
+                    size -= row_size
+                    if size <= self.max_bytes:
+                        break
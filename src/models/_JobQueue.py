@@ -0,0 +1,136 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+from ..utils import encode_bytes
+
+
+class JobQueue:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, db_path: str, lease_time: float, max_attempts: int, result_ttl: float):
+        self.db_path = db_path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self.local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, request TEXT NOT NULL, callback_url TEXT, "
+                "result TEXT, error TEXT, error_code INTEGER, attempts INTEGER NOT NULL DEFAULT 0, "
+                "lease_until REAL, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created_at ON jobs (status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Every gunicorn worker drains the same file, sqlite serializes the claims between them
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self.local.conn = conn
+
+        return conn
+
+    def submit(self, request: dict, callback_url: str = None) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO jobs (id, status, request, callback_url, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, self.QUEUED, json.dumps(request), callback_url, now, now),
+        )
+        return job_id
+
+    def claim(self):
+        # A running job whose lease expired belongs to a worker that died, it goes back to the queue
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, error_code = ?, updated_at = ? "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (self.FAILED, "Job was abandoned too many times", 500, now, self.RUNNING, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT id, request, callback_url, attempts FROM jobs "
+                "WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY created_at LIMIT 1",
+                (self.QUEUED, self.RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?",
+                    (self.RUNNING, now + self.lease_time, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if row is None:
+            return None
+
+        # The attempt identifies the claim, a worker that lost its lease can't write the job anymore
+        return row["id"], json.loads(row["request"]), row["callback_url"], row["attempts"] + 1
+
+    def renew(self, job_id: str, attempt: int) -> bool:
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND attempts = ? AND status = ?",
+            (now + self.lease_time, now, job_id, attempt, self.RUNNING),
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job_id: str, attempt: int, result: dict) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, request = '{}', lease_until = NULL, updated_at = ? "
+            "WHERE id = ? AND attempts = ?",
+            (self.DONE, json.dumps(result, default=encode_bytes), time.time(), job_id, attempt),
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: str, attempt: int, message: str, error_code: int) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = ?, error = ?, error_code = ?, request = '{}', lease_until = NULL, "
+            "updated_at = ? WHERE id = ? AND attempts = ?",
+            (self.FAILED, message, error_code, time.time(), job_id, attempt),
+        )
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str):
+        row = self._connect().execute(
+            "SELECT id, status, result, error, error_code, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        job = {
+            "id": row["id"],
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "createdAt": row["created_at"],
+            "updatedAt": row["updated_at"],
+        }
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+            job["errorCode"] = row["error_code"]
+
+        return job
+
+    def purge(self):
+        if self.result_ttl:
+            self._connect().execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (self.DONE, self.FAILED, time.time() - self.result_ttl),
+            )
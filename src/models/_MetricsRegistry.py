@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class MetricsRegistry:
+    PREFIX = "maskrcnn_"
+    FILE_NAME = "metrics.json"
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, worker_name: str, log_dir: str, flush_interval: float = 5):
+        self.worker_name = worker_name
+        self.file_path = os.path.join(log_dir, self.FILE_NAME)
+        self.metrics_dir = os.path.join(log_dir, "..")
+        self.flush_interval = flush_interval
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._flush_periodically)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def observe(self, stage: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {"buckets": [0] * len(self.BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+            trace = getattr(self.local, "trace", None)
+            if trace is not None:
+                trace[stage] = trace.get(stage, 0) + seconds
+
+    @contextmanager
+    def time(self, stage: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start_time)
+
+    def start_trace(self):
+        self.local.trace = {}
+
+    def stop_trace(self) -> dict:
+        trace = getattr(self.local, "trace", None)
+        self.local.trace = None
+        return trace or {}
+
+    def traced(self, func):
+        # Stages observed by pool threads working for the request are added to its trace too
+        trace = getattr(self.local, "trace", None)
+
+        def wrapper(*args, **kwargs):
+            previous = getattr(self.local, "trace", None)
+            self.local.trace = trace
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.local.trace = previous
+
+        return wrapper
+
+    def inc(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def add_collector(self, collector):
+        # Collectors return {"counters": {...}, "gauges": {...}} read from the components that
+        # already keep their own numbers, like the model cache stats
+        self.collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        counters = {}
+        gauges = {}
+        for collector in self.collectors:
+            values = collector()
+            counters.update(values.get("counters", {}))
+            gauges.update(values.get("gauges", {}))
+
+        with self.lock:
+            return {
+                "worker": self.worker_name,
+                "histograms": json.loads(json.dumps(self.histograms)),
+                "counters": {**self.counters, **counters},
+                "gauges": {**self.gauges, **gauges},
+            }
+
+    def flush(self):
+        # Written with a rename so the worker serving the scrape never reads half a file
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, self.file_path)
+
+    def render(self) -> str:
+        self.flush()
+        histograms = {}
+        counters = {}
+        gauges = []
+        for snapshot, is_alive in self._read_snapshots():
+            for stage, histogram in snapshot["histograms"].items():
+                total = histograms.setdefault(stage, {"buckets": [0] * len(self.BUCKETS), "sum": 0.0, "count": 0})
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], histogram["buckets"])]
+                total["sum"] += histogram["sum"]
+                total["count"] += histogram["count"]
+            for name, value in snapshot["counters"].items():
+                counters[name] = counters.get(name, 0) + value
+            if is_alive:
+                gauges.extend((name, snapshot["worker"], value) for name, value in snapshot["gauges"].items())
+
+        lines = []
+        name = self.PREFIX + "stage_duration_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for stage in sorted(histograms):
+            histogram = histograms[stage]
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS, histogram["buckets"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+
+        for counter in sorted(counters):
+            lines.append(f"# TYPE {self.PREFIX}{counter} counter")
+            lines.append(f"{self.PREFIX}{counter} {counters[counter]}")
+
+        for gauge in sorted(set(name for name, _, _ in gauges)):
+            lines.append(f"# TYPE {self.PREFIX}{gauge} gauge")
+            for name, worker, value in gauges:
+                if name == gauge:
+                    lines.append(f'{self.PREFIX}{gauge}{{worker="{worker}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+    def _read_snapshots(self):
+        # Counters of dead workers are still summed so the totals never go back, their gauges
+        # stop being reported once the file is no longer refreshed
+        stale_time = time.time() - 3 * self.flush_interval
+        for item in os.listdir(self.metrics_dir):
+            file_path = os.path.join(self.metrics_dir, item, self.FILE_NAME)
+            if not os.path.isfile(file_path):
+                continue
+
+            try:
+                with open(file_path, "r") as f:
+                    snapshot = json.load(f)
+                yield snapshot, file_path == self.file_path or os.path.getmtime(file_path) >= stale_time
+            except (OSError, ValueError):
+                continue
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
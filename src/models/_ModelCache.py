@@ -1,22 +1,45 @@
+import gc
 import json
-from typing import Dict
+import time
+import ctypes
+import psutil
+import threading
+import tensorflow as tf
+from typing import Dict, List
 from logging import Logger
 from mrcnn.Configs import Config
 
-from ..exceptions import NotFoundException, ServiceUnavailableException, SystemBlockedException
+from ..exceptions import BadRequestException, NotFoundException, ServiceUnavailableException, SystemBlockedException
 from ._ModelWrapper import ModelWrapper
+from ._RemoteModelWrapper import RemoteModelWrapper
 from ._APIConfig import APIConfig
+from ._MetricsRegistry import MetricsRegistry
 
 
 class ModelCache:
 
-    def __init__(self, logger: Logger, api_config: APIConfig) -> None:
+    def __init__(self, logger: Logger, api_config: APIConfig, inference_client=None, metrics: MetricsRegistry = None) -> None:
         self.cache = {}
         self.logger = logger
         self.api_config = api_config
+        self.inference_client = inference_client
+        self.metrics = metrics
         self.models_config: Dict[str, Config] = {}
         self.weights = {}
         self.extra_config = {}
+        self.backend_config = {}
+        self.preload_config = {}
+        self.class_index: Dict[str, str] = {}
+        self.footprints: Dict[str, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        # Every read and write of the cache happens with the condition held, except the model
+        # construction: loading weights takes seconds and must not stop the other threads, so the
+        # slot is counted in _loading while the model is built outside the lock
+        self._condition = threading.Condition()
+        self._loading: Dict[str, int] = {}
+        # Instances replaced by a weights reload, released once their in-flight requests end
+        self._draining: List[ModelWrapper] = []
+        self._generations: Dict[str, int] = {}
 
         self._load_models_config()
     
@@ -32,83 +55,396 @@ class ModelCache:
                 num_classes=item["numClasses"],
                 class_names=item["classNames"],
             )
-            self.weights[item["name"]] = "logs/weights/{}".format(item["weights"])
+            self.weights[item["name"]] = self._get_weights_path(item["weights"])
+            self.backend_config[item["name"]] = {
+                "backend": item.get("backend", "keras"),
+                "precision": item.get("precision", "fp32"),
+                "threads": item.get("threads", 0),
+            }
+            ModelWrapper.validate_backend(self.backend_config[item["name"]])
+            for class_name in item["classNames"]:
+                # The background class is in every model, it is never requested
+                if class_name.lower() == "bg":
+                    continue
+                model_key = self.class_index.setdefault(class_name.lower(), item["name"])
+                if model_key != item["name"]:
+                    self.logger.warning(
+                        f"Class {class_name} of model {item['name']} is also in model {model_key}, "
+                        f"requests for it go to {model_key}"
+                    )
+            if item.get("preload", False):
+                self.preload_config[item["name"]] = item.get("warmUp", True)
+    
+    def preload_models(self):
+        if self.inference_client is not None:
+            return
+        
+        for key, warm_up in self.preload_config.items():
+            with self._condition:
+                if not self._can_create_new_model(key):
+                    self.logger.warning(f"Cache limit reached, model {key} won't be preloaded")
+                    continue
+                self._loading[key] = self._loading.get(key, 0) + 1
+            
+            start_time = time.monotonic()
+            model = self._load_model(key)
+            load_time = time.monotonic() - start_time
+            try:
+                if warm_up:
+                    model.warm_up()
+            finally:
+                self.release_model(model)
+            
+            self.logger.info("Model {} preloaded in {:.2f}s (load {:.2f}s, warm up {:.2f}s)".format(
+                key, time.monotonic() - start_time, load_time, time.monotonic() - start_time - load_time
+            ))
+    
+    def reload_model(self, key: str, weights_file: str, warm_up: bool = True):
+        if self.inference_client is not None:
+            raise BadRequestException("Models are loaded by the inference servers, they can't be reloaded")
+        
+        weights_path = self._get_weights_path(weights_file)
+        with self._condition:
+            if key not in self.models_config:
+                raise NotFoundException(f"There is no model {key}")
+            if not self.cache.get(key):
+                # Not loaded in this worker, the next load of the model uses the new weights
+                self._set_weights(key, weights_path)
+                self.logger.info(f"Model {key} isn't loaded, weights {weights_file} recorded for its next load")
+                return
+            self._loading[key] = self._loading.get(key, 0) + 1
+        
+        # The new instance is built and warmed up while the old ones keep serving, the swap below
+        # is the only moment the requests see
+        start_time = time.monotonic()
+        try:
+            model = self._build_model(key, weights_path)
+            if warm_up:
+                model.warm_up()
+        except Exception:
+            with self._condition:
+                self._finish_loading(key)
+            raise
+        
+        with self._condition:
+            self._finish_loading(key)
+            self._set_weights(key, weights_path)
+            old_models = self.cache.get(key, [])
+            if old_models:
+                self.cache[key] = [model]
+                self.footprints[key] = model.footprint
+            else:
+                # Evicted while the new instance was built, the cache limits are not bypassed
+                old_models = [model]
+            released = [self._drain_model(old_model) for old_model in old_models]
+        if any(released):
+            self._release_memory()
+        
+        self.logger.info("Model {} reloaded with {} in {:.2f}s, draining {} old instances".format(
+            key, weights_file, time.monotonic() - start_time, len(old_models)
+        ))
     
     def clean_cache(self):
-        self.models_config.clear()
-        self.weights.clear()
-        self.cache.clear()
+        with self._condition:
+            self.models_config.clear()
+            self.weights.clear()
+            self.class_index.clear()
+            models = [model for models in self.cache.values() for model in models]
+            self.cache.clear()
+            if self.inference_client is not None:
+                for model in models:
+                    model.release()
+                released = []
+            else:
+                # Requests already holding a model finish on it, the busy ones are released by
+                # release_model. All of them are draining first so the session outlives every one
+                self._draining.extend(models)
+                released = [self._drain_model(model) for model in models]
+            self._condition.notify_all()
+        
+        if any(released):
+            self._release_memory()
+    
+    def get_stats(self) -> dict:
+        with self._condition:
+            return {
+                **self.stats,
+                "evictionPolicy": self.api_config.model_eviction_policy,
+                "memoryBudget": self.api_config.model_memory_budget,
+                "memoryUsed": self._get_memory_used(),
+                "draining": len(self._draining),
+                "models": [
+                    {
+                        "name": key,
+                        "footprint": getattr(model, "footprint", 0),
+                        "uses": getattr(model, "uses", 0),
+                        "inUse": getattr(model, "in_use", 0),
+                    }
+                    for key, models in self.cache.items()
+                    for model in models
+                ],
+            }
+    
+    def get_metrics(self) -> dict:
+        with self._condition:
+            models = [model for models in self.cache.values() for model in models]
+            return {
+                "counters": {
+                    "model_cache_hits_total": self.stats["hits"],
+                    "model_cache_misses_total": self.stats["misses"],
+                    "model_cache_evictions_total": self.stats["evictions"],
+                },
+                "gauges": {
+                    "models_loaded": len(models),
+                    "models_in_use": sum([getattr(model, "in_use", 0) for model in models]),
+                    "models_draining": len(self._draining),
+                    "model_queue_depth": sum([max(model.in_use - 1, 0) for model in models if hasattr(model, "in_use")]),
+                    "model_memory_bytes": self._get_memory_used(),
+                },
+            }
     
-    def get_model_based_on_data(self, data: dict) -> ModelWrapper:
+    def get_model_keys(self, data: dict) -> Dict[str, List[str]]:
         if not self.models_config and not self.cache:
             raise SystemBlockedException()
         
-        classes = data["classes"]
+        classes = data.get("classes")
+        if not classes:
+            raise BadRequestException("no classes found in request")
+        
         self.logger.info("Request inference received for detection for {}".format(classes))
         
-        model_key = ""
-        for key, config in self.models_config.items():
-            found = sum([class_name.lower() == classes[0].lower() for class_name in config.CLASS_NAMES])
-            if found:
-                model_key = key
-                break
+        model_keys = {}
+        not_found = []
+        for class_name in classes:
+            model_key = self.class_index.get(class_name.lower())
+            if model_key is None:
+                not_found.append(class_name)
+            else:
+                model_keys.setdefault(model_key, []).append(class_name)
         
-        if not model_key:
-            raise NotFoundException("There is no model with classes {}".format(classes))
+        if not_found:
+            raise NotFoundException("There is no model with classes {}".format(not_found))
         
-        return self._get_available_model(model_key)
+        return model_keys
     
-    def _create_cached_model(self, key: str):
-        self.logger.info(f"Creating and caching model for weights {key}")
-        if key not in self.cache:
-            self.cache[key] = []
+    def get_model(self, key: str, timeout: float = None) -> ModelWrapper:
+        return self._get_available_model(key, self.api_config.model_wait_timeout if timeout is None else timeout)
+    
+    def release_model(self, model: ModelWrapper):
+        if self.inference_client is not None:
+            return
+        
+        with self._condition:
+            model.in_use -= 1
+            released = model in self._draining and self._drain_model(model)
+            self._condition.notify_all()
+        
+        if released:
+            self._release_memory()
+    
+    def _load_model(self, key: str) -> ModelWrapper:
+        # The caller already counted the slot in _loading, the model is returned reserved
+        with self._condition:
+            weights_path, generation = self.weights[key], self._generations.get(key, 0)
+        try:
+            model = self._build_model(key, weights_path)
+        except Exception:
+            with self._condition:
+                self._finish_loading(key)
+            raise
+        
+        with self._condition:
+            self._finish_loading(key)
+            if self._generations.get(key, 0) != generation:
+                # The weights were swapped while this instance was built with the old ones
+                self._draining.append(model)
+            else:
+                self.cache.setdefault(key, []).append(model)
+                self.footprints[key] = model.footprint
+            return self._reserve_model(model)
+    
+    def _finish_loading(self, key: str):
+        self._loading[key] -= 1
+        if not self._loading[key]:
+            del self._loading[key]
+        self._condition.notify_all()
+    
+    def _set_weights(self, key: str, weights_path: str):
+        self.weights[key] = weights_path
+        self._generations[key] = self._generations.get(key, 0) + 1
+    
+    def _drain_model(self, model: ModelWrapper) -> bool:
+        if model in self._draining:
+            self._draining.remove(model)
+        if model.in_use or model.lock.locked:
+            self._draining.append(model)
+            return False
         
+        self._release_model(model)
+        return True
+    
+    def _build_model(self, key: str, weights_path: str) -> ModelWrapper:
+        self.logger.info(f"Creating and caching model for weights {key}")
+        rss_before = psutil.Process().memory_info().rss
         model = ModelWrapper(
             mode="inference",
             config=self.models_config.get(key),
             model_dir=self.api_config.log_dir,
-            extra_config=self.extra_config.get(key)
+            extra_config=self.extra_config.get(key),
+            backend_config=self.backend_config.get(key),
         )
-        model.load_weights(filepath=self.weights[key], by_name=True)
-        self.cache[key].append(model)
+        model.load_weights(filepath=weights_path, by_name=True)
+        model.lock.fifo = self.api_config.model_queue_fifo
+        model.lock.on_release = self._notify_model_released
+        model.metrics = self.metrics
+        # The RSS growth is the real cost of the instance, the parameters size is a lower bound
+        # for when the allocator reused memory freed by a previous eviction
+        model.footprint = max(
+            psutil.Process().memory_info().rss - rss_before,
+            model.keras_model.count_params() * 4,
+        )
+        self.logger.info("Model {} uses {:.2f}Mb".format(key, model.footprint / (1024 * 1024)))
         
         return model
     
-    def _can_create_new_model(self):
-        return sum([len(models) for models in self.cache.values()]) < self.api_config.max_instances_model
+    def _can_create_new_model(self, key: str):
+        models_qty = sum([len(models) for models in self.cache.values()]) + sum(self._loading.values())
+        if models_qty == 0:
+            return True
+        if models_qty >= self.api_config.max_instances_model:
+            return False
+        if self.api_config.model_memory_budget <= 0:
+            return True
+        
+        loading_memory = sum([self._estimate_footprint(loading_key) * qty for loading_key, qty in self._loading.items()])
+        return self._get_memory_used() + loading_memory + self._estimate_footprint(key) <= \
+            self.api_config.model_memory_budget
     
-    def _clean_cache(self):
-        if len(self.cache.keys()) == 1:
-            self.cache.clear()
+    def _get_memory_used(self) -> int:
+        models = [model for models in self.cache.values() for model in models] + self._draining
+        return sum([getattr(model, "footprint", 0) for model in models])
+    
+    @staticmethod
+    def _get_weights_path(weights_file: str) -> str:
+        return "logs/weights/{}".format(weights_file)
+    
+    def _estimate_footprint(self, key: str) -> int:
+        if key in self.footprints:
+            return self.footprints[key]
+        if self.footprints:
+            return sum(self.footprints.values()) // len(self.footprints)
+        
+        return 0
+    
+    def _reserve_model(self, model: ModelWrapper) -> ModelWrapper:
+        model.in_use += 1
+        model.uses += 1
+        model.last_used = time.monotonic()
+        return model
+    
+    def _notify_model_released(self):
+        with self._condition:
+            self._condition.notify_all()
+    
+    def _clean_cache(self) -> bool:
+        candidates = [
+            (key, model)
+            for key, models in self.cache.items()
+            for model in models
+            if not model.in_use and not model.lock.locked and not model.lock.waiting
+        ]
+        if not candidates:
+            return False
+        
+        if self.api_config.model_eviction_policy == "lfu":
+            key, model = min(candidates, key=lambda candidate: (candidate[1].uses, candidate[1].last_used))
         else:
-            minor_timestamp = None
-            minor_key = None
-            model_index = None
-            for key, models in self.cache.items():
-                if minor_timestamp is None and models:
-                    minor_timestamp = models[0].lock.last_time_locked
-
-                for i, model in enumerate(models):
-                    if minor_timestamp <= model.lock.last_time_locked and not model.lock.locked:
-                        minor_timestamp = model.lock.last_time_locked
-                        minor_key = key
-                        model_index = i
+            key, model = min(candidates, key=lambda candidate: candidate[1].last_used)
+        
+        self.logger.info("Evicting model {} used {} times ({:.2f}Mb)".format(
+            key, model.uses, model.footprint / (1024 * 1024)
+        ))
+        self.cache[key].remove(model)
+        if not self.cache[key]:
+            del self.cache[key]
+        self._release_model(model)
+        self.stats["evictions"] += 1
+        return True
+    
+    def _release_model(self, model: ModelWrapper):
+        # Dropping the python references is not enough, the Keras graph has to be released too.
+        # The session is only cleared when no other thread is building or running a model on it
+        model.release()
+        if not self.cache and not self._loading and not self._draining:
+            tf.keras.backend.clear_session()
+    
+    def _release_memory(self):
+        # The allocator arenas go back to the OS after the collection. Both are slow, they run
+        # without the condition held
+        gc.collect()
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+    
+    def _get_remote_model(self, key: str) -> RemoteModelWrapper:
+        with self._condition:
+            if key not in self.cache:
+                self.logger.info(f"Creating remote model for weights {key}")
+                self.cache[key] = [RemoteModelWrapper(
+                    key=key,
+                    config=self.models_config.get(key),
+                    inference_client=self.inference_client,
+                    extra_config=self.extra_config.get(key),
+                )]
             
-            if minor_key:
-                self.cache[minor_key].pop(model_index)
-            else:
-                raise ServiceUnavailableException("All models are locked and cache can't be cleaned")
+            return self.cache[key][0]
     
-    def _get_available_model(self, key: str) -> ModelWrapper:
-        models = self.cache.get(key, [])
-        for model in models:
-            if not model.lock.locked:
-                return model
+    def _get_available_model(self, key: str, timeout: float) -> ModelWrapper:
+        if self.inference_client is not None:
+            return self._get_remote_model(key)
         
-        if self._can_create_new_model():
-            return self._create_cached_model(key)
+        deadline = time.monotonic() + timeout
+        evicted = False
+        try:
+            with self._condition:
+                while True:
+                    models = self.cache.get(key, [])
+                    for model in models:
+                        if not model.in_use and not model.lock.locked:
+                            self.stats["hits"] += 1
+                            return self._reserve_model(model)
+                    
+                    if self._can_create_new_model(key):
+                        self.stats["misses"] += 1
+                        self._loading[key] = self._loading.get(key, 0) + 1
+                        break
+                    
+                    if models:
+                        # Every instance is busy: join the shortest admission queue, the caller
+                        # waits on the model lock inside detect up to its timeout. The queue counts
+                        # every reservation, also the ones that didn't reach the lock yet
+                        model = min(models, key=lambda model: model.in_use)
+                        if model.in_use - 1 >= self.api_config.model_queue_size:
+                            raise ServiceUnavailableException(
+                                f"Admission queue for model {key} is full, try again later"
+                            )
+                        self.stats["hits"] += 1
+                        return self._reserve_model(model)
+                    
+                    # A model of this key being built will be free soon, evicting for a second one is wasteful
+                    if not self._loading.get(key):
+                        self.logger.info("Cache limit reached, cleaning and creating new model")
+                        if self._clean_cache():
+                            evicted = True
+                            continue
+                    
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise ServiceUnavailableException("All models are locked and cache can't be cleaned")
+                    self._condition.wait(remaining)
+        finally:
+            if evicted:
+                self._release_memory()
         
-        self.logger.info("Cache limit reached, cleaning and creating new model")
-        self._clean_cache()
-        return self._create_cached_model(key)
-        
\ No newline at end of file
+        return self._load_model(key)
@@ -1,22 +1,75 @@
+import threading
+from collections import deque
 from datetime import datetime
 
 
 class ModelLock:
-    def __init__(self):
-        self.locked = False
+    def __init__(self, fifo: bool = True):
+        self.fifo = fifo
+        self.on_release = None
+        self._locked = False
+        self._waiters = deque()
+        self._condition = threading.Condition()
         self._last_time_locked = None
 
+    @property
+    def locked(self):
+        return self._locked
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
     @property
     def last_time_locked(self):
         return self._last_time_locked
-    
+
     @last_time_locked.setter
     def last_time_locked(self, value):
         pass
-    
-    def __enter__(self):
+
+    def acquire(self, timeout: float = None) -> bool:
+        with self._condition:
+            if self._can_acquire(None):
+                self._take()
+                return True
+            if timeout is not None and timeout <= 0:
+                return False
+
+            ticket = object()
+            self._waiters.append(ticket)
+            try:
+                acquired = self._condition.wait_for(lambda: self._can_acquire(ticket), timeout)
+                if acquired:
+                    self._take()
+                return acquired
+            finally:
+                self._waiters.remove(ticket)
+                self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self._locked = False
+            self._condition.notify_all()
+
+        if self.on_release is not None:
+            self.on_release()
+
+    def _can_acquire(self, ticket) -> bool:
+        if self._locked:
+            return False
+        if not self.fifo or not self._waiters:
+            return True
+
+        return self._waiters[0] is ticket
+
+    def _take(self):
         self._last_time_locked = datetime.now()
-        self.locked = True
-    
+        self._locked = True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
     def __exit__(self, exc_type, exc_value, traceback):
-        self.locked = False
+        self.release()
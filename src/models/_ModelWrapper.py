@@ -1,37 +1,127 @@
+import os
+import time
+import shutil
+import numpy as np
 from mrcnn.model import MaskRCNN
 from mrcnn.Configs import Config
 
 from ..exceptions import LockedException
 from ._ModelLock import ModelLock
 from ._ShapeClassifier import ShapeClassifier
+from ._SavedModelBackend import SavedModelBackend
+from ._ONNXBackend import ONNXBackend
 
 
 class ModelWrapper(MaskRCNN):
+    BACKENDS = {backend.NAME: backend for backend in (SavedModelBackend, ONNXBackend)}
 
-    def __init__(self, mode: str, config: Config, model_dir: str, extra_config: dict=None):
+    def __init__(self, mode: str, config: Config, model_dir: str, extra_config: dict=None, backend_config: dict=None):
         super().__init__(mode, config, model_dir)
+        self.backend_config = backend_config or {}
+        self.backend = None
         self.lock = ModelLock()
-        self.shape_classifier = None
-        
-        if extra_config is not None and extra_config["name"] == "ShapeClassifier":
-            self.shape_classifier = ShapeClassifier(
-                weights_path=f"./logs/weights/{extra_config['weights']}",
-                classes=extra_config["classes"],
-                filter_by_class_name=extra_config.get("className"),
-            )
+        self.shape_classifier = ShapeClassifier.from_extra_config(extra_config)
+        self.footprint = 0
+        self.in_use = 0
+        self.uses = 0
+        self.last_used = time.monotonic()
+        self.metrics = None
     
-    def detect(self, images: list, verbose=0) -> list:
-        if self.lock.locked:
+    def detect(self, images: list, verbose=0, timeout: float = 0) -> list:
+        wait_start = time.perf_counter()
+        if not self.lock.acquire(timeout=timeout):
+            if self.metrics is not None:
+                self.metrics.inc("model_locked_total")
             raise LockedException("MaskRCNN model is already processing, try again later.")
         
-        with self.lock:
-            return super().detect(images, verbose)
+        detect_start = time.perf_counter()
+        try:
+            if self.backend is None:
+                return super().detect(images, verbose)
+            return self._detect_with_backend(images)
+        finally:
+            self.lock.release()
+            if self.metrics is not None:
+                self.metrics.observe("lock_wait", detect_start - wait_start)
+                self.metrics.observe("detect", time.perf_counter() - detect_start)
+    
+    @staticmethod
+    def validate_backend(backend_config: dict):
+        name = backend_config.get("backend", "keras")
+        precision = backend_config.get("precision", "fp32")
+        if name == "keras":
+            if precision != "fp32":
+                raise ValueError("The keras backend only runs in fp32")
+            return
+        if name not in ModelWrapper.BACKENDS:
+            raise ValueError(f"Unknown backend {name}, use one of {['keras'] + list(ModelWrapper.BACKENDS)}")
+        if precision not in ModelWrapper.BACKENDS[name].PRECISIONS:
+            raise ValueError(f"Backend {name} doesn't support {precision}, use one of {ModelWrapper.BACKENDS[name].PRECISIONS}")
+    
+    def load_weights(self, filepath: str, by_name: bool = False, **kwargs):
+        super().load_weights(filepath, by_name=by_name, **kwargs)
+        self.backend = self._build_backend(filepath)
+    
+    def warm_up(self):
+        # A synthetic batch forces graph tracing before the first real request arrives
+        image = np.zeros((self.config.IMAGE_MIN_DIM, self.config.IMAGE_MIN_DIM, 3), dtype=np.uint8)
+        self.detect([image] * self.config.BATCH_SIZE)
+    
+    def release(self):
+        self.keras_model = None
+        self.backend = None
+        self.shape_classifier = None
     
     def get_extra_metrics(self, mask, class_name: str) -> dict:
-        metrics = {}
+        return self.get_extra_metrics_batch([mask], [class_name])[0]
+    
+    def get_extra_metrics_batch(self, masks: list, class_names: list) -> list:
+        metrics = [{} for _ in masks]
         if self.shape_classifier is not None:
-            shape = self.shape_classifier.predict(mask, class_name)
-            if shape is not None:
-                metrics["shape"] = shape
+            shapes = self.shape_classifier.predict_batch(masks, class_names)
+            for item, shape in zip(metrics, shapes):
+                if shape is not None:
+                    item["shape"] = shape
         
         return metrics
+    
+    def _build_backend(self, weights_path: str):
+        name = self.backend_config.get("backend", "keras")
+        if name == "keras":
+            return None
+        
+        # The export is kept next to the weights, so reloaded weights get their own export and
+        # the other workers reuse the one of the first worker that built it
+        backend_class = self.BACKENDS[name]
+        precision = self.backend_config.get("precision", "fp32")
+        export_path = "{}.{}.{}".format(os.path.splitext(weights_path)[0], precision, backend_class.EXTENSION)
+        if not os.path.exists(export_path):
+            tmp_path = "{}.{}.tmp".format(export_path, os.getpid())
+            backend_class.export(self.keras_model, tmp_path, precision)
+            try:
+                os.replace(tmp_path, export_path)
+            except OSError:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        
+        return backend_class(export_path, threads=self.backend_config.get("threads", 0))
+    
+    def _detect_with_backend(self, images: list) -> list:
+        # Same steps as MaskRCNN.detect, only the graph execution goes to the backend
+        molded_images, image_metas, windows = self.mold_inputs(images)
+        anchors = self.get_anchors(molded_images[0].shape)
+        anchors = np.broadcast_to(anchors, (self.config.BATCH_SIZE,) + anchors.shape)
+        detections, mrcnn_mask = self.backend.predict(molded_images, image_metas, anchors)
+        
+        results = []
+        for i, image in enumerate(images):
+            final_rois, final_class_ids, final_scores, final_masks = self.unmold_detections(
+                detections[i], mrcnn_mask[i], image.shape, molded_images[i].shape, windows[i]
+            )
+            results.append({
+                "rois": final_rois,
+                "class_ids": final_class_ids,
+                "scores": final_scores,
+                "masks": final_masks,
+            })
+        
+        return results
@@ -0,0 +1,57 @@
+import os
+import numpy as np
+import tensorflow as tf
+
+try:
+    import onnx
+    import tf2onnx
+    import onnxruntime
+    from onnxconverter_common import float16
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError:
+    onnxruntime = None
+
+
+class ONNXBackend:
+    NAME = "onnx"
+    EXTENSION = "onnx"
+    PRECISIONS = ("fp32", "fp16", "int8")
+    OPSET = 13
+
+    def __init__(self, path: str, threads: int = 0):
+        self._check_installed()
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [item.name for item in self.session.get_inputs()]
+
+    @staticmethod
+    def export(keras_model, path: str, precision: str):
+        ONNXBackend._check_installed()
+        # Only the detections and the masks are used by detect, the other heads are left out
+        model = tf.keras.Model(keras_model.inputs, [keras_model.outputs[0], keras_model.outputs[3]])
+        input_signature = [tf.TensorSpec(tensor.shape, tf.float32) for tensor in keras_model.inputs]
+        fp32_path = path if precision == "fp32" else path + ".fp32"
+        tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=ONNXBackend.OPSET, output_path=fp32_path)
+
+        if precision == "fp16":
+            # Inputs and outputs stay float32, so the molding and unmolding code doesn't change
+            onnx.save(float16.convert_float_to_float16(onnx.load(fp32_path), keep_io_types=True), path)
+        elif precision == "int8":
+            quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+        if fp32_path != path:
+            os.remove(fp32_path)
+
+    def predict(self, molded_images: np.ndarray, image_metas: np.ndarray, anchors: np.ndarray) -> tuple:
+        inputs = [molded_images, image_metas, anchors]
+        detections, masks = self.session.run(None, {
+            name: np.asarray(value, dtype=np.float32) for name, value in zip(self.input_names, inputs)
+        })
+        return detections, masks
+
+    @staticmethod
+    def _check_installed():
+        if onnxruntime is None:
+            raise ImportError("The onnx backend needs onnxruntime, tf2onnx and onnxconverter-common installed")
@@ -0,0 +1,31 @@
+from mrcnn.Configs import Config
+
+from ._ShapeClassifier import ShapeClassifier
+
+
+class RemoteModelWrapper:
+
+    def __init__(self, key: str, config: Config, inference_client, extra_config: dict=None):
+        self.key = key
+        self.config = config
+        self.inference_client = inference_client
+        self.shape_classifier = ShapeClassifier.from_extra_config(extra_config)
+    
+    def detect(self, images: list, verbose=0, timeout: float = 0) -> list:
+        return self.inference_client.detect(self.key, images, timeout)
+    
+    def release(self):
+        self.shape_classifier = None
+    
+    def get_extra_metrics(self, mask, class_name: str) -> dict:
+        return self.get_extra_metrics_batch([mask], [class_name])[0]
+    
+    def get_extra_metrics_batch(self, masks: list, class_names: list) -> list:
+        metrics = [{} for _ in masks]
+        if self.shape_classifier is not None:
+            shapes = self.shape_classifier.predict_batch(masks, class_names)
+            for item, shape in zip(metrics, shapes):
+                if shape is not None:
+                    item["shape"] = shape
+        
+        return metrics
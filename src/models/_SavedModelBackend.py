@@ -0,0 +1,39 @@
+import numpy as np
+import tensorflow as tf
+
+
+class SavedModelBackend:
+    NAME = "savedmodel"
+    EXTENSION = "savedmodel"
+    PRECISIONS = ("fp32",)
+    INPUT_NAMES = ("images", "metas", "anchors")
+
+    def __init__(self, path: str, threads: int = 0):
+        # The exported graph runs as one concrete function, without the per call overhead of
+        # Keras predict. Threads are set for the whole TF runtime, so they are left to TF here
+        self.model = tf.saved_model.load(path)
+        self.function = self.model.signatures["serving_default"]
+
+    @staticmethod
+    def export(keras_model, path: str, precision: str):
+        input_signature = [
+            tf.TensorSpec(tensor.shape, tf.float32, name=name)
+            for tensor, name in zip(keras_model.inputs, SavedModelBackend.INPUT_NAMES)
+        ]
+
+        @tf.function(input_signature=input_signature)
+        def serve(images, metas, anchors):
+            outputs = keras_model([images, metas, anchors], training=False)
+            return {"detections": outputs[0], "masks": outputs[3]}
+
+        module = tf.Module()
+        module.keras_model = keras_model
+        tf.saved_model.save(module, path, signatures={"serving_default": serve})
+
+    def predict(self, molded_images: np.ndarray, image_metas: np.ndarray, anchors: np.ndarray) -> tuple:
+        outputs = self.function(
+            images=tf.constant(molded_images, tf.float32),
+            metas=tf.constant(image_metas, tf.float32),
+            anchors=tf.constant(anchors, tf.float32),
+        )
+        return outputs["detections"].numpy(), outputs["masks"].numpy()
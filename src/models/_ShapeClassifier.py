@@ -11,10 +11,36 @@ class ShapeClassifier:
         with open(weights_path, "rb") as f:
             self.model = pickle.load(f)
     
-    def predict(self, img, class_name: str):
-        if class_name != self.filter_by_class_name and self.filter_by_class_name != None:
+    @staticmethod
+    def from_extra_config(extra_config: dict):
+        if extra_config is None or extra_config["name"] != "ShapeClassifier":
             return None
         
+        return ShapeClassifier(
+            weights_path=f"./logs/weights/{extra_config['weights']}",
+            classes=extra_config["classes"],
+            filter_by_class_name=extra_config.get("className"),
+        )
+    
+    def predict(self, img, class_name: str):
+        return self.predict_batch([img], [class_name])[0]
+    
+    def predict_batch(self, imgs: list, class_names: list) -> list:
+        shapes = [None] * len(imgs)
+        indexes = [
+            i for i, class_name in enumerate(class_names)
+            if class_name == self.filter_by_class_name or self.filter_by_class_name == None
+        ]
+        if not indexes:
+            return shapes
+        
+        data = np.array([self._get_features(imgs[i]) for i in indexes])
+        for i, class_id in zip(indexes, self.model.predict(data)):
+            shapes[i] = self.classes[class_id]
+        
+        return shapes
+    
+    def _get_features(self, img) -> list:
         data = []
         regions = skimage.measure.regionprops(label_image=img)
         max_region = max(regions, key=lambda region: region.area)
@@ -38,7 +64,4 @@ class ShapeClassifier:
         data.append(height)
         data.append(aspect_ratio)
 
-        data = np.array(data).reshape(1, -1)
-        class_id = self.model.predict(data)[0]
-        
-        return self.classes[class_id]
+        return data
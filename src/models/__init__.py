@@ -3,3 +3,9 @@ from ._ModelCache import ModelCache
 from ._APIConfig import APIConfig
 from ._ModelWrapper import ModelWrapper
 from ._ShapeClassifier import ShapeClassifier
+from ._InferenceCache import InferenceCache
+from ._RemoteModelWrapper import RemoteModelWrapper
+from ._JobQueue import JobQueue
+from ._MetricsRegistry import MetricsRegistry
+from ._SavedModelBackend import SavedModelBackend
+from ._ONNXBackend import ONNXBackend
@@ -33,3 +33,12 @@ class ConfigRoute:
                 raise BadRequestException(f"{key} is not a valid config!")
             if has_key and hasattr(self.api_config, f"_{key}"):
                 raise BadRequestException(f"{key} is not a valid config!")
+        
+        if "tile_size" in request or "tile_overlap" in request:
+            try:
+                APIConfig.validate_tiling(
+                    int(request.get("tile_size", self.api_config.tile_size)),
+                    int(request.get("tile_overlap", self.api_config.tile_overlap)),
+                )
+            except (TypeError, ValueError) as ex:
+                raise BadRequestException(str(ex))
@@ -0,0 +1,35 @@
+from logging import Logger
+
+from ..models import JobQueue
+from ..services import JobService
+from ..exceptions import BadRequestException, NotFoundException
+from ._MaskRCNNInferenceRoute import MaskRCNNInferenceRoute
+
+
+class JobsRoute:
+
+    def __init__(self, logger: Logger, job_queue: JobQueue, job_service: JobService, inference_route: MaskRCNNInferenceRoute):
+        self.logger = logger
+        self.job_queue = job_queue
+        self.job_service = job_service
+        self.inference_route = inference_route
+
+    def create(self, request: dict) -> dict:
+        callback_url = request.pop("callbackUrl", None)
+        if callback_url is not None and not callback_url.startswith(("http://", "https://")):
+            raise BadRequestException("callbackUrl must be an http(s) url")
+
+        # Invalid requests are refused now instead of becoming failed jobs
+        self.inference_route.validate(request)
+        job_id = self.job_queue.submit(request, callback_url)
+        self.job_service.notify()
+        self.logger.info(f"Job {job_id} queued")
+
+        return {"id": job_id, "status": JobQueue.QUEUED}
+
+    def get(self, job_id: str) -> dict:
+        job = self.job_queue.get(job_id)
+        if job is None:
+            raise NotFoundException(f"Job {job_id} not found")
+
+        return job
@@ -1,37 +1,274 @@
+import json
+import time
 import uuid
 import cv2 as cv
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from logging import Logger
 
-from ..exceptions import BadRequestException
-from ..models import APIConfig, ModelWrapper
-from ..handlers import ImageServiceHandler
+from ..exceptions import BadRequestException, ServiceUnavailableException
+from ..models import APIConfig, ModelCache, ModelWrapper, InferenceCache, MetricsRegistry
+from ..handlers import ImageServiceHandler, ImageTilingHandler, MaskFormatHandler, ImageFetcher
+from ..services import DetectionBatcher
+from ..utils import encode_bytes
 
 
 class MaskRCNNInferenceRoute:
+    MASK_CROP_MARGIN = 1
 
-    def __init__(self, logger: Logger, api_config: APIConfig) -> None:
+    def __init__(
+            self,
+            logger: Logger,
+            api_config: APIConfig,
+            model_cache: ModelCache,
+            inference_cache: InferenceCache,
+            metrics: MetricsRegistry
+    ) -> None:
         self.logger = logger
+        self.metrics = metrics
         self.api_config = api_config
-        self.image_handler = ImageServiceHandler(self.api_config.images_dir, self.logger)
+        self.model_cache = model_cache
+        self.inference_cache = inference_cache
+        self.image_handler = ImageServiceHandler(
+            self.api_config.images_dir,
+            self.logger,
+            archive_images=self.api_config.archive_images,
+            image_fetcher=ImageFetcher(
+                self.logger,
+                connect_timeout=self.api_config.image_fetch_connect_timeout,
+                read_timeout=self.api_config.image_fetch_read_timeout,
+                max_bytes=self.api_config.image_fetch_max_bytes,
+                pool_size=self.api_config.image_fetch_pool_size,
+                max_workers=self.api_config.image_fetch_workers,
+            ),
+        )
+        self.tiling_handler = ImageTilingHandler(self.api_config)
+        self.mask_format_handler = MaskFormatHandler()
+        self.detection_batcher = DetectionBatcher(self.logger, self.api_config)
+        self.model_executor = ThreadPoolExecutor(max_workers=max(len(self.model_cache.models_config), 1))
+        self.postprocess_executor = ThreadPoolExecutor(max_workers=self.api_config.postprocess_workers)
     
-    def process(self, request: dict, model: ModelWrapper) -> dict:
+    def process(self, request: dict) -> dict:
         self._validate_request(request)
+        mask_format = self.mask_format_handler.get_mask_format(request)
+        timeout = self._get_timeout(request)
+        model_keys = self.model_cache.get_model_keys(request)
         
-        image = self.image_handler.get_image(request)
-        images = [((0, 0), image)]
-        if image.shape[0] > 1024 and image.shape[1] > 1024 and self.api_config.split_images_above_maximum:
-            self.logger.info("Image received has {} which is above the maximum (1024, 1024, 3), splitting image in 4...".format(image.shape))
-            height, width, _ = image.shape
-            images = [
-                ((0,0), image[0:height//2, 0:width//2].copy()),
-                ((height//2, 0), image[height//2:height, 0:width//2].copy()),
-                ((0, width//2), image[0:height//2, width//2:width].copy()),
-                ((height//2, width//2), image[height//2:height, width//2:width].copy())
-            ]
-            self.logger.info("Image splitted successfully")
+        with self.metrics.time("fetch"):
+            image = self.image_handler.get_image(request)
+        return self._process_image(image, model_keys, mask_format, time.monotonic() + timeout)
+    
+    def close(self):
+        self.image_handler.close()
+        self.model_executor.shutdown(wait=False)
+        self.postprocess_executor.shutdown(wait=False)
+
+    def validate(self, request: dict):
+        self._validate_request(request)
+        self.mask_format_handler.get_mask_format(request)
+        self._get_timeout(request)
+        self.model_cache.get_model_keys(request)
+    
+    def process_upload(self, request: dict, image_buffer: bytes, content_type: str) -> dict:
+        self._validate_upload_request(request)
+        mask_format = self.mask_format_handler.get_mask_format(request)
+        timeout = self._get_timeout(request)
+        model_keys = self.model_cache.get_model_keys(request)
+
+        with self.metrics.time("fetch"):
+            image = self.image_handler.get_uploaded_image(image_buffer, content_type)
+        return self._process_image(image, model_keys, mask_format, time.monotonic() + timeout)
+    
+    def process_batch(self, request: dict):
+        self._validate_batch_request(request)
+        mask_format = self.mask_format_handler.get_mask_format(request)
+        timeout = self._get_timeout(request)
+        model_keys = self.model_cache.get_model_keys(request)
+        
+        # The request is validated before the first line is sent, errors after that point are
+        # reported per image because the status code is already gone
+        return self._stream_batch(request["images"], model_keys, mask_format, timeout)
+    
+    def _stream_batch(self, images_data: list, model_keys: dict, mask_format: str, timeout: float):
+        chunk_size = max(self.model_cache.models_config[model_key].BATCH_SIZE for model_key in model_keys)
+        self.logger.info(f"Processing batch of {len(images_data)} images in chunks of {chunk_size}")
+        
+        futures = self.image_handler.get_images(images_data[:chunk_size])
+        for start in range(0, len(images_data), chunk_size):
+            current = futures
+            # The next chunk downloads while the current one is on the model
+            futures = self.image_handler.get_images(images_data[start + chunk_size:start + 2 * chunk_size])
+            
+            lines = {}
+            images = []
+            for index, future in enumerate(current, start):
+                try:
+                    with self.metrics.time("fetch"):
+                        images.append((index, future.result()))
+                except Exception as ex:
+                    self.logger.exception(ex)
+                    lines[index] = self._get_batch_error(index, ex)
+            
+            if images:
+                try:
+                    # Every chunk is admitted on its own, with the whole timeout of the request
+                    deadline = time.monotonic() + timeout
+                    outputs = self._process_images([image for _, image in images], model_keys, mask_format, deadline)
+                    for (index, _), output in zip(images, outputs):
+                        lines[index] = {'index': index, **output}
+                except Exception as ex:
+                    self.logger.exception(ex)
+                    for index, _ in images:
+                        lines[index] = self._get_batch_error(index, ex)
+            
+            for index in sorted(lines):
+                yield json.dumps(lines[index], default=encode_bytes) + "\n"
+    
+    def _get_timeout(self, request: dict) -> float:
+        # Seconds the request waits for a model instance, the server default when it's missing
+        timeout = request.get("timeout")
+        if timeout is None:
+            return self.api_config.model_wait_timeout
+        try:
+            timeout = float(timeout)
+        except (TypeError, ValueError):
+            timeout = 0
+        if timeout <= 0:
+            raise BadRequestException("timeout must be a positive number of seconds")
+        
+        return timeout
+    
+    def _get_remaining(self, deadline: float) -> float:
+        # The timeout is one budget for the whole inference, every wait gets what is left of it
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ServiceUnavailableException("Timeout waiting for a model, try again later")
+        
+        return remaining
+    
+    def _get_batch_error(self, index: int, ex: Exception) -> dict:
+        return {
+            'index': index,
+            'error': ex.message if hasattr(ex, "message") else str(ex),
+            'code': ex.error_code if hasattr(ex, "error_code") else 500,
+        }
+    
+    def _process_images(self, images: list, model_keys: dict, mask_format: str, deadline: float) -> list:
+        if len(model_keys) == 1:
+            outputs = [self._process_model_batch(images, next(iter(model_keys)), mask_format, deadline)]
+        else:
+            outputs = list(self.model_executor.map(
+                self.metrics.traced(lambda model_key: self._process_model_batch(images, model_key, mask_format, deadline)),
+                model_keys
+            ))
+        
+        return [
+            {
+                'inferences': [inference for output in image_outputs for inference in output['inferences']],
+                'imgSize': image.shape
+            }
+            for image, image_outputs in zip(images, zip(*outputs))
+        ]
+    
+    def _process_image(self, image, model_keys: dict, mask_format: str, deadline: float) -> dict:
+        if len(model_keys) == 1:
+            outputs = [self._process_model(image, next(iter(model_keys)), mask_format, deadline)]
+        else:
+            # Classes served by different models run concurrently and are merged in one response
+            self.logger.info(f"Classes requested are split across models {list(model_keys)}")
+            outputs = list(self.model_executor.map(
+                self.metrics.traced(lambda model_key: self._process_model(image, model_key, mask_format, deadline)),
+                model_keys
+            ))
+        
+        return {
+            'inferences': [inference for output in outputs for inference in output['inferences']],
+            'imgSize': image.shape
+        }
+    
+    def _process_model(self, image, model_key: str, mask_format: str, deadline: float) -> dict:
+        cache_key = None
+        if self.inference_cache.enabled:
+            cache_key = self.inference_cache.build_key(image, *self._get_cache_params(model_key), mask_format)
+            output_data = self.inference_cache.get(cache_key)
+            if output_data is not None:
+                self.logger.info("Inference found in cache, replying cached response")
+                self.metrics.inc("inference_cache_hits_total")
+                return output_data
+            self.metrics.inc("inference_cache_misses_total")
 
-        return self._parse_detections(images, image.shape, model)
+        with self.metrics.time("model_wait"):
+            model = self.model_cache.get_model(model_key, self._get_remaining(deadline))
+        try:
+            output_data = self._run_inference(image, model, mask_format, deadline)
+        finally:
+            self.model_cache.release_model(model)
+        if cache_key is not None:
+            self.inference_cache.put(cache_key, output_data)
+
+        return output_data
+    
+    def _process_model_batch(self, images: list, model_key: str, mask_format: str, deadline: float) -> list:
+        outputs = [None] * len(images)
+        cache_keys = [None] * len(images)
+        if self.inference_cache.enabled:
+            for i, image in enumerate(images):
+                cache_keys[i] = self.inference_cache.build_key(image, *self._get_cache_params(model_key), mask_format)
+                outputs[i] = self.inference_cache.get(cache_keys[i])
+                self.metrics.inc("inference_cache_hits_total" if outputs[i] is not None else "inference_cache_misses_total")
+        
+        pending = [i for i, output in enumerate(outputs) if output is None]
+        if not pending:
+            return outputs
+        
+        with self.metrics.time("model_wait"):
+            model = self.model_cache.get_model(model_key, self._get_remaining(deadline))
+        try:
+            # Images that fit in a tile share one detect call, the bigger ones are tiled one by one
+            whole = [i for i in pending if not self.tiling_handler.should_split(images[i])]
+            if whole:
+                results = self.detection_batcher.detect(model, [images[i] for i in whole], self._get_remaining(deadline))
+                for i, res in zip(whole, results):
+                    outputs[i] = self._parse_detections(self._get_detections(res), images[i].shape, model, mask_format)
+            for i in pending:
+                if outputs[i] is None:
+                    outputs[i] = self._run_inference(images[i], model, mask_format, deadline)
+        finally:
+            self.model_cache.release_model(model)
+        
+        for i in pending:
+            if cache_keys[i] is not None:
+                self.inference_cache.put(cache_keys[i], outputs[i])
+        
+        return outputs
+    
+    def _get_cache_params(self, model_key: str) -> list:
+        # The weights file changes on a reload, so results of the previous weights are not reused
+        return [
+            model_key,
+            self.model_cache.weights.get(model_key),
+            self.api_config.approx_epsilon,
+            self.api_config.split_images_above_maximum,
+            self.api_config.tile_size,
+            self.api_config.tile_overlap,
+            self.api_config.tile_merge_iou,
+            self.model_cache.extra_config.get(model_key),
+        ]
+    
+    def _run_inference(self, image, model: ModelWrapper, mask_format: str, deadline: float) -> dict:
+        if self.tiling_handler.should_split(image):
+            self.logger.info("Image received has {} which is above the tile size {}, splitting image in tiles...".format(
+                image.shape, self.api_config.tile_size
+            ))
+            tiles = self.tiling_handler.split(image)
+            self.logger.info(f"Image splitted successfully in {len(tiles)} tiles")
+            results = self.detection_batcher.detect(model, [tile for _, tile in tiles], self._get_remaining(deadline))
+            detections = self.tiling_handler.merge(tiles, results)
+        else:
+            res = self.detection_batcher.detect(model, [image], self._get_remaining(deadline))[0]
+            detections = self._get_detections(res)
+
+        return self._parse_detections(detections, image.shape, model, mask_format)
     
     def _validate_request(self, data) -> None:
         self.logger.info("Validating request")
@@ -45,39 +282,86 @@ class MaskRCNNInferenceRoute:
             not image_data.startswith("https://"):
             raise BadRequestException("Image encode format not allowed, valid format are base64 (data:filename/png;base64,image_base64_data) or URL")      
 
-    def _parse_detections(self, images, img_shape, model) -> dict:
+    def _validate_batch_request(self, data) -> None:
+        self.logger.info("Validating batch request")
+        if not data.get('classes'):
+            raise BadRequestException(message="no classes found in request")
+        if not isinstance(data.get('images'), list) or not data['images']:
+            raise BadRequestException(message="no images found in request")
+
+    def _validate_upload_request(self, data) -> None:
+        self.logger.info("Validating upload request")
+        if not data.get('classes'):
+            raise BadRequestException(message="no classes found in request")
+
+    def _get_detections(self, res) -> list:
+        # Masks are only pasted inside their rois, so the crop keeps every pixel of the instance
+        # and contours are found on a small window instead of the whole frame
+        height, width = res["masks"].shape[:2]
+        detections = []
+        for i in range(len(res["class_ids"])):
+            bbox = res["rois"][i].tolist()
+            y1, x1 = max(bbox[0] - self.MASK_CROP_MARGIN, 0), max(bbox[1] - self.MASK_CROP_MARGIN, 0)
+            y2, x2 = min(bbox[2] + self.MASK_CROP_MARGIN, height), min(bbox[3] + self.MASK_CROP_MARGIN, width)
+            detections.append({
+                "class_id": int(res["class_ids"][i]),
+                "score": float(res["scores"][i]),
+                "bbox": bbox,
+                "mask": res["masks"][y1:y2, x1:x2, i],
+                "offset": (y1, x1),
+            })
+        
+        return detections
+
+    def _parse_detections(self, detections, img_shape, model, mask_format: str) -> dict:
         self.logger.info("Starting to parse results of inference")
         
+        masks = [self._to_uint8(detection["mask"]) for detection in detections]
+        class_names = [model.config.CLASS_NAMES[detection["class_id"]] for detection in detections]
+        with self.metrics.time("contours"):
+            inferences = list(self.postprocess_executor.map(
+                lambda detection, mask, class_name: self._parse_detection(detection, mask, class_name, mask_format),
+                detections,
+                masks,
+                class_names
+            ))
+        with self.metrics.time("shape_classifier"):
+            extra_metrics = self._get_extra_metrics(masks, model, class_names)
+        for obj, metrics in zip(inferences, extra_metrics):
+            obj.update(metrics)
+        
         output_data = {
-            'inferences': [],
+            'inferences': inferences,
             'imgSize': img_shape
         }
-        for data in images:
-            adjust, image = data
-            res = model.detect([image], verbose=1)[0]
-            for i in range(len(res["class_ids"])):
-                mask = res["masks"][:, :, i]
-                bbox = res["rois"][i].tolist()
-                class_name = model.config.CLASS_NAMES[res["class_ids"][i]]
-                obj = {
-                    'id': str(uuid.uuid4()),
-                    'bbox': [bbox[0] + adjust[0], bbox[1] + adjust[1], bbox[2] + adjust[0], bbox[3] + adjust[1]],
-                    'className': class_name,
-                    'score': float(res["scores"][i]),
-                    'points': self._parse_mask(mask, adjust),
-                }
-                metrics = self._get_extra_metrics(mask, model, class_name)
-                obj.update(metrics)
-                output_data['inferences'].append(obj)
         
         self.logger.info("Results parsed successfully, replying response")
         return output_data
     
-    def _get_extra_metrics(self, mask, model: ModelWrapper, class_name: str):
-        return model.get_extra_metrics(mask.astype(np.uint8) * 255, class_name)
+    def _parse_detection(self, detection: dict, mask: np.ndarray, class_name: str, mask_format: str) -> dict:
+        obj = {
+            'id': str(uuid.uuid4()),
+            'bbox': detection["bbox"],
+            'className': class_name,
+            'score': detection["score"],
+        }
+        if mask_format == "polygon":
+            obj['points'] = self._parse_mask(mask, detection["offset"])
+        else:
+            obj['mask'] = self.mask_format_handler.encode(mask, detection["offset"], detection["bbox"], mask_format)
+        
+        return obj
+    
+    def _to_uint8(self, mask) -> np.ndarray:
+        mask = np.ascontiguousarray(mask)
+        return mask.view(np.uint8) if mask.dtype == bool else mask.astype(np.uint8)
+    
+    def _get_extra_metrics(self, masks: list, model: ModelWrapper, class_names: list) -> list:
+        # regionprops features don't depend on the label value, so the 0/1 crops are used as they are
+        return model.get_extra_metrics_batch(masks, class_names)
 
     def _parse_mask(self, mask, adjust) -> list:
-        contours, _ = cv.findContours(mask.astype(np.uint8), cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
         
         return self._convert_mask_img_to_2d_array_contours(contours, adjust)
     
@@ -0,0 +1,10 @@
+from ..models import MetricsRegistry
+
+
+class MetricsRoute:
+
+    def __init__(self, metrics: MetricsRegistry):
+        self.metrics = metrics
+
+    def process(self) -> str:
+        return self.metrics.render()
@@ -0,0 +1,10 @@
+from ..models import ModelCache
+
+
+class ModelCacheStatsRoute:
+
+    def __init__(self, model_cache: ModelCache):
+        self.model_cache = model_cache
+
+    def process(self):
+        return self.model_cache.get_stats()
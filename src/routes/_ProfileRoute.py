@@ -0,0 +1,23 @@
+from logging import Logger
+
+from ..services import ZMQClient
+from ..exceptions import BadRequestException
+
+
+class ProfileRoute:
+    def __init__(self, zmq_client: ZMQClient, logger: Logger) -> None:
+        self.zmq_client = zmq_client
+        self.logger = logger
+
+    def process(self, request: dict):
+        seconds = request.get("seconds", 30)
+        if not isinstance(seconds, (int, float)) or seconds <= 0:
+            raise BadRequestException("seconds must be a positive number")
+
+        seconds = min(seconds, self.zmq_client.profiler.max_seconds)
+        self.logger.info(f"Profile request received, profiling every worker for {seconds}s")
+        # The broadcast also reaches this worker, starting it here covers a server without the ZMQ master
+        self.zmq_client.profiler.start(seconds)
+        self.zmq_client.send_message(f"PROFILE:{seconds}")
+
+        return {"seconds": seconds}
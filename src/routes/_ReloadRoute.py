@@ -0,0 +1,91 @@
+import os
+import uuid
+import threading
+from logging import Logger
+
+from ..models import ModelCache
+from ..services import ZMQClient, WeightsDownloader
+from ..handlers import ModelReloadHandler
+from ..exceptions import BadRequestException, NotFoundException
+
+
+class ReloadRoute:
+
+    def __init__(
+            self,
+            logger: Logger,
+            zmq_client: ZMQClient,
+            model_cache: ModelCache,
+            reload_handler: ModelReloadHandler,
+            downloader: WeightsDownloader,
+    ):
+        self.logger = logger
+        self.zmq_client = zmq_client
+        self.model_cache = model_cache
+        self.reload_handler = reload_handler
+        self.downloader = downloader
+
+    def create(self, request: dict) -> dict:
+        model_key = request.get("model")
+        weight = request.get("weights")
+        if not model_key or not isinstance(weight, dict):
+            raise BadRequestException("model and weights are required")
+
+        missing = [key for key in ("name", "url", "fileType") if not weight.get(key)]
+        if missing:
+            raise BadRequestException(f"weights must have {missing}")
+        if model_key not in self.model_cache.models_config:
+            raise NotFoundException(f"There is no model {model_key}")
+        if self.model_cache.inference_client is not None:
+            raise BadRequestException("Models are loaded by the inference servers, they can't be reloaded")
+
+        # Without a checksum an existing file would be taken as the new weights
+        file_path = self.downloader.get_file_path(weight)
+        if os.path.exists(file_path) and not weight.get("sha256"):
+            raise BadRequestException(f"Weights {weight['name']} already exist, send a new name or their sha256")
+
+        reload_id = uuid.uuid4().hex
+        weights_file = os.path.basename(file_path)
+        self.zmq_client.send_reload_ack(reload_id, model_key, weights_file, "downloading")
+        th = threading.Thread(target=self._download_and_reload, args=(reload_id, model_key, weight, weights_file))
+        th.daemon = True
+        th.start()
+
+        self.logger.info(f"Reload {reload_id} of model {model_key} with {weights_file} started")
+        return {"id": reload_id, "status": "downloading"}
+
+    def get(self, reload_id: str) -> dict:
+        try:
+            reload_status = self.zmq_client.get_reload(reload_id)
+        except Exception as ex:
+            self.logger.exception(ex)
+            reload_status = None
+
+        if reload_status is None:
+            self.logger.warning("Master didn't reply with the reload, replying only this worker")
+            ack = self.zmq_client.reloads.get(reload_id)
+            if ack is not None:
+                reload_status = {
+                    "id": reload_id,
+                    "model": ack["model"],
+                    "weights": ack["weights"],
+                    "status": "running" if ack["status"] in ("downloading", "loading") else ack["status"],
+                    "workers": {self.zmq_client.worker_name: {"status": ack["status"], "error": ack["error"]}},
+                }
+
+        if not reload_status:
+            raise NotFoundException(f"Reload {reload_id} not found")
+
+        return reload_status
+
+    def _download_and_reload(self, reload_id: str, model_key: str, weight: dict, weights_file: str):
+        # Weights are downloaded once, every worker of the machine loads them from logs/weights
+        try:
+            self.downloader.download(weight)
+            self.reload_handler.save_config(model_key, weight, weights_file)
+        except Exception as ex:
+            self.logger.exception(ex)
+            self.zmq_client.send_reload_ack(reload_id, model_key, weights_file, "failed", str(ex))
+            return
+
+        self.zmq_client.reload(reload_id, model_key, weights_file)
@@ -4,3 +4,8 @@ from ._MaskRCNNTrainingRoute import MaskRCNNTrainingRoute
 from ._ConfigRoute import ConfigRoute
 from ._GetWorkersRoute import GetWorkersRoute
 from ._BlockRoute import BlockRoute
+from ._ModelCacheStatsRoute import ModelCacheStatsRoute
+from ._JobsRoute import JobsRoute
+from ._MetricsRoute import MetricsRoute
+from ._ProfileRoute import ProfileRoute
+from ._ReloadRoute import ReloadRoute
@@ -0,0 +1,118 @@
+import time
+import threading
+from logging import Logger
+from typing import Dict, List
+
+from ..models import APIConfig, ModelWrapper
+from ..exceptions import ServiceUnavailableException
+
+
+class _PendingDetection:
+    def __init__(self, image):
+        self.image = image
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class DetectionBatcher:
+
+    def __init__(self, logger: Logger, api_config: APIConfig):
+        self.logger = logger
+        self.api_config = api_config
+        self._condition = threading.Condition()
+        self._pending: Dict[int, List[_PendingDetection]] = {}
+        self._leaders = set()
+
+    def detect(self, model: ModelWrapper, images: list, timeout: float = None) -> list:
+        timeout = self.api_config.model_wait_timeout if timeout is None else timeout
+        # One deadline for the follower wait and every detect call, not a new timeout for each
+        deadline = time.monotonic() + timeout
+        batch_size = model.config.BATCH_SIZE
+        if self.api_config.batch_window_time <= 0 or batch_size == 1:
+            return self._run_detect(model, images, deadline)
+
+        # Requests are batched per reserved instance, so every instance runs its own batches with
+        # the weights it was reserved with
+        key = id(model)
+        requests = [_PendingDetection(image) for image in images]
+        with self._condition:
+            self._pending.setdefault(key, []).extend(requests)
+            self._condition.notify_all()
+            while not all(pending.done.is_set() for pending in requests):
+                if key not in self._leaders:
+                    self._leaders.add(key)
+                    break
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue = self._pending.get(key, [])
+                    queue[:] = [pending for pending in queue if pending not in requests]
+                    raise ServiceUnavailableException("Timeout waiting for a batched detection, try again later")
+                self._condition.wait(remaining)
+            else:
+                return self._get_results(requests)
+
+        self._lead(key, model, batch_size, requests, deadline)
+        return self._get_results(requests)
+
+    def _lead(self, key, model: ModelWrapper, batch_size: int, requests: list, deadline: float):
+        # The leader only runs batches until its own images are done, then the leadership goes
+        # to one of the waiting requests
+        try:
+            while not all(pending.done.is_set() for pending in requests):
+                with self._condition:
+                    queue = self._pending[key]
+                    window_end = time.monotonic() + self.api_config.batch_window_time
+                    while len(queue) < batch_size:
+                        remaining = window_end - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+
+                    batch = queue[:batch_size]
+                    del queue[:batch_size]
+
+                self.logger.info(f"Running batched detection of {len(batch)} images for model {model.config.NAME}")
+                try:
+                    results = self._run_detect(model, [pending.image for pending in batch], deadline)
+                    for pending, result in zip(batch, results):
+                        pending.result = result
+                except Exception as ex:
+                    for pending in batch:
+                        pending.error = ex
+                finally:
+                    with self._condition:
+                        for pending in batch:
+                            pending.done.set()
+                        self._condition.notify_all()
+        finally:
+            with self._condition:
+                self._leaders.discard(key)
+                if not self._pending.get(key):
+                    self._pending.pop(key, None)
+                self._condition.notify_all()
+
+    def _get_results(self, requests: list) -> list:
+        for pending in requests:
+            if pending.error is not None:
+                raise pending.error
+
+        return [pending.result for pending in requests]
+
+    def _run_detect(self, model: ModelWrapper, images: list, deadline: float) -> list:
+        batch_size = model.config.BATCH_SIZE
+        results = []
+        for start in range(0, len(images), batch_size):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ServiceUnavailableException("Timeout waiting for the model, try again later")
+            chunk = images[start:start + batch_size]
+            # MaskRCNN.detect requires exactly BATCH_SIZE images, so incomplete batches
+            # are padded with the last image and the extra results are discarded.
+            padded = chunk + [chunk[-1]] * (batch_size - len(chunk))
+            results.extend(
+                model.detect(padded, verbose=1, timeout=remaining)[:len(chunk)]
+            )
+
+        return results
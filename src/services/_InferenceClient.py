@@ -0,0 +1,66 @@
+import zmq
+import json
+import logging
+import threading
+
+from ..utils import pack_arrays, unpack_arrays
+from ..exceptions import (
+    BadRequestException, LockedException, NotFoundException, ServiceUnavailableException, UnprocessableRequest
+)
+
+
+class InferenceClient:
+    ERRORS = {
+        400: BadRequestException,
+        404: NotFoundException,
+        423: LockedException,
+        503: ServiceUnavailableException,
+    }
+    RESULT_KEYS = ("rois", "class_ids", "scores", "masks")
+
+    def __init__(self, addresses: list, logger: logging.Logger, timeout: float):
+        self.addresses = addresses
+        self.logger = logger
+        self.timeout = timeout
+        self.context = zmq.Context()
+        self.local = threading.local()
+    
+    def detect(self, model_key: str, images: list, timeout: float) -> list:
+        headers, frames = pack_arrays(images)
+        request = {"model": model_key, "timeout": timeout, "arrays": headers}
+        
+        socket = self._get_socket()
+        socket.send_multipart([json.dumps(request).encode(), *frames], copy=False)
+        if not socket.poll(int((self.timeout + timeout) * 1000)):
+            # A REQ socket can't send again before receiving, so a late reply forces a new socket
+            self._close_socket()
+            raise ServiceUnavailableException("Inference server did not reply in time")
+        
+        reply = socket.recv_multipart(copy=False)
+        response = json.loads(reply[0].bytes)
+        if "error" in response:
+            exception = self.ERRORS.get(response["errorCode"], UnprocessableRequest)
+            raise exception(response["error"])
+        
+        arrays = unpack_arrays(response["arrays"], [frame.buffer for frame in reply[1:]])
+        size = len(self.RESULT_KEYS)
+        return [
+            dict(zip(self.RESULT_KEYS, arrays[index:index + size]))
+            for index in range(0, len(arrays), size)
+        ]
+    
+    def _get_socket(self):
+        # ZMQ sockets are not thread safe, each thread keeps its own connection to the servers
+        socket = getattr(self.local, "socket", None)
+        if socket is None:
+            socket = self.context.socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            for address in self.addresses:
+                socket.connect(address)
+            self.local.socket = socket
+        
+        return socket
+    
+    def _close_socket(self):
+        self.local.socket.close()
+        self.local.socket = None
@@ -0,0 +1,103 @@
+import os
+import zmq
+import json
+import time
+import logging
+import multiprocessing
+from dotenv import load_dotenv
+
+from ..utils import pack_arrays, unpack_arrays
+from ..models import APIConfig, ModelCache
+
+
+class InferenceServer:
+
+    def __init__(self, index: int, logger: logging.Logger) -> None:
+        self.index = index
+        self.logger = logger
+        self.name = f"InferenceServer{index}"
+        self.address = InferenceServer.get_address(index)
+        self.process = None
+    
+    @staticmethod
+    def get_address(index: int) -> str:
+        return f"ipc:///tmp/inference-{index}.sock"
+    
+    def start(self):
+        if self.process is None:
+            self.logger.info(f"Starting {self.name} on {self.address}")
+            # spawn keeps the TensorFlow runtime of the server independent from the master process
+            context = multiprocessing.get_context("spawn")
+            self.process = context.Process(target=_serve, args=(self.name, self.address), daemon=True)
+            self.process.start()
+    
+    def stop(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+
+def _serve(name: str, address: str):
+    load_dotenv()
+    log_dir = os.path.join("/app/logs", name)
+    if not os.path.exists(log_dir):
+        os.mkdir(log_dir)
+    
+    logger = _build_logger(name, log_dir)
+    api_config = APIConfig.from_environ(log_dir=log_dir, images_dir="./images")
+    model_cache = ModelCache(logger, api_config)
+    model_cache.preload_models()
+
+    context = zmq.Context()
+    router_socket = context.socket(zmq.ROUTER)
+    router_socket.bind(address)
+    logger.info(f"{name} is ready listening on {address}")
+
+    while True:
+        identity, empty, header, *frames = router_socket.recv_multipart(copy=False)
+        try:
+            request = json.loads(header.bytes)
+            images = unpack_arrays(request["arrays"], [frame.buffer for frame in frames])
+            # The lock wait only gets what the admission left of the request timeout
+            deadline = time.monotonic() + request["timeout"]
+            model = model_cache.get_model(request["model"], request["timeout"])
+            try:
+                results = model.detect(images, verbose=1, timeout=max(deadline - time.monotonic(), 0))
+            finally:
+                model_cache.release_model(model)
+
+            headers, frames = pack_arrays([
+                result[key]
+                for result in results
+                for key in ("rois", "class_ids", "scores", "masks")
+            ])
+            response = {"arrays": headers}
+        except Exception as ex:
+            logger.exception(ex)
+            frames = []
+            response = {
+                "error": ex.message if hasattr(ex, "message") else str(ex),
+                "errorCode": ex.error_code if hasattr(ex, "error_code") else 500,
+            }
+        
+        router_socket.send_multipart([identity, empty, json.dumps(response).encode(), *frames], copy=False)
+
+
+def _build_logger(name: str, log_dir: str):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    handler = logging.StreamHandler()
+
+    handler.setLevel(logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    file_handler = logging.FileHandler(
+        filename=os.path.join(log_dir, name + ".log"),
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(formatter)
+    logger.addHandler(file_handler)
+
+    return logger
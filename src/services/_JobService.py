@@ -0,0 +1,103 @@
+import time
+import requests
+import threading
+from logging import Logger
+
+from ..models import JobQueue
+
+
+class JobService:
+
+    def __init__(self, logger: Logger, job_queue: JobQueue, process, workers: int, poll_interval: float = 1):
+        self.logger = logger
+        self.job_queue = job_queue
+        self.process = process
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.threads = []
+        self.running = False
+        self._wake_up = threading.Event()
+
+    def start(self):
+        if self.threads or self.workers <= 0:
+            return
+
+        self.running = True
+        self.logger.info(f"Starting {self.workers} job workers")
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"JobWorker-{index}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        self._wake_up.set()
+
+    def notify(self):
+        self._wake_up.set()
+
+    def _work(self):
+        last_purge = 0
+        while self.running:
+            try:
+                if time.monotonic() - last_purge > 60:
+                    self.job_queue.purge()
+                    last_purge = time.monotonic()
+
+                job = self.job_queue.claim()
+            except Exception as ex:
+                self.logger.exception(ex)
+                job = None
+
+            if job is None:
+                # Jobs submitted to other workers are only seen on the next poll
+                self._wake_up.wait(self.poll_interval)
+                self._wake_up.clear()
+                continue
+
+            self._run(*job)
+
+        self.logger.info("Job worker stopped")
+
+    def _run(self, job_id: str, request: dict, callback_url: str, attempt: int):
+        self.logger.info(f"Running job {job_id}")
+        # The lease is renewed while the job runs, so a long job isn't claimed again by another worker
+        finished = threading.Event()
+        renewer = threading.Thread(target=self._renew_lease, args=(job_id, attempt, finished))
+        renewer.daemon = True
+        renewer.start()
+        try:
+            stored = self.job_queue.complete(job_id, attempt, self.process(request))
+        except Exception as ex:
+            self.logger.exception(ex)
+            stored = self.job_queue.fail(
+                job_id,
+                attempt,
+                ex.message if hasattr(ex, "message") else str(ex),
+                ex.error_code if hasattr(ex, "error_code") else 500,
+            )
+        finally:
+            finished.set()
+
+        if not stored:
+            self.logger.warning(f"Job {job_id} lost its lease, the result of attempt {attempt} was discarded")
+            return
+        if callback_url:
+            self._send_callback(job_id, callback_url)
+
+    def _renew_lease(self, job_id: str, attempt: int, finished: threading.Event):
+        while not finished.wait(self.job_queue.lease_time / 3):
+            try:
+                if not self.job_queue.renew(job_id, attempt):
+                    self.logger.warning(f"Lease of job {job_id} couldn't be renewed")
+                    return
+            except Exception as ex:
+                self.logger.exception(ex)
+
+    def _send_callback(self, job_id: str, callback_url: str):
+        try:
+            response = requests.post(callback_url, json=self.job_queue.get(job_id), timeout=10)
+            self.logger.info(f"Callback of job {job_id} replied with status code {response.status_code}")
+        except requests.RequestException as ex:
+            self.logger.warning(f"Callback of job {job_id} to {callback_url} failed: {ex}")
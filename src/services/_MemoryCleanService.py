@@ -4,20 +4,46 @@ import logging
 import threading
 from dotenv import load_dotenv
 
+from ..models import MetricsRegistry
+
 
 class MemoryCleanService:
+    GB = 1024 * 1024 * 1024
+    # Files modified this recently may still be written by a worker, so their size is read again
+    RECENT_TIME = 30
 
-    def __init__(self, images_dir: str, max_file_size: float, clean_time_window: float) -> None:
+    def __init__(
+            self,
+            images_dir: str,
+            max_file_size: float,
+            clean_time_window: float,
+            check_interval: float = 5,
+            high_watermark: float = 0.9,
+            low_watermark: float = 0.7,
+            max_deletes_per_second: float = 100,
+            metrics: MetricsRegistry = None,
+    ) -> None:
         load_dotenv()
         self.thread = None
         self.images_dir = images_dir
         self.max_file_size = max_file_size
         self.clean_time_window = clean_time_window
+        self.check_interval = check_interval
+        self.high_watermark_bytes = int(max_file_size * high_watermark * self.GB)
+        self.low_watermark_bytes = int(max_file_size * low_watermark * self.GB)
+        self.max_deletes_per_second = max_deletes_per_second
+        self.metrics = metrics
         self.logger = self._build_logger("./logs/memoryCleaner.log")
         self.running = False
+        # Running byte total of the images dir, kept from the files seen in previous scans
+        self.files = {}
+        self.total_bytes = 0
+        self._dir_mtime = None
+        self._last_full_scan = 0
 
         self.logger.info(
-            f"Memory cleaner configured with images_dir: {images_dir}, max_file_size: {max_file_size}Gb and clean_time_window: {clean_time_window}s"
+            f"Memory cleaner configured with images_dir: {images_dir}, max_file_size: {max_file_size}Gb, "
+            f"watermarks: {high_watermark}/{low_watermark} and clean_time_window: {clean_time_window}s"
         )
     
     def _build_logger(self, log_dir: str):
@@ -52,40 +78,115 @@ class MemoryCleanService:
     
     def _clean_files(self):
         while self.running:
-            time.sleep(self.clean_time_window)
-            consumed_size = sum([
-                os.path.getsize(os.path.join(self.images_dir, file_name)) / (1024 * 1024 * 1024)
-                for file_name in os.listdir(self.images_dir)
-            ])
-            if consumed_size < self.max_file_size:
-                self.logger.info(f"The memory size is {consumed_size}, no need to clean yet")
-                continue
-
-            self.logger.info("Max file size reached, starting clean")
-            files_erased = 0
-            locked_files = 0
-            size_cleaned = 0
-            for file_name in os.listdir(self.images_dir):
-                if file_name.endswith(".lock") or self._file_is_locked(file_name):
-                    locked_files += 1
-                    continue
+            try:
+                start_time = time.perf_counter()
+                self._update_sizes()
+                scan_time = time.perf_counter() - start_time
+                if self.metrics is not None:
+                    self.metrics.observe("images_scan", scan_time)
+                    self.metrics.set_gauge("images_dir_bytes", self.total_bytes)
+                    self.metrics.set_gauge("images_dir_files", len(self.files))
                 
-                file_path = os.path.join(self.images_dir, file_name)
-                try:
-                    size_cleaned += os.path.getsize(file_path) / (1024 * 1024 * 1024)
-                    os.remove(file_path)
-                    files_erased += 1
-                except:
-                    pass
+                if self.total_bytes > self.high_watermark_bytes:
+                    self._evict()
+                else:
+                    self.logger.debug(f"The memory size is {self.total_bytes / self.GB}Gb, no need to clean yet")
+            except Exception as ex:
+                self.logger.exception(ex)
             
-            self.logger.info(
-                "Clean ended successfully with {} files erased ({}Gb), locked files reimained {}".format(
-                    files_erased, size_cleaned, locked_files
-                )
-            )
+            time.sleep(self.check_interval)
         
         self.logger.info("Memory cleaner thread stopped")
     
+    def _update_sizes(self):
+        # The dir mtime only changes when files are added or removed, so most checks only read
+        # again the files that may still be growing. Every clean_time_window all the sizes are
+        # read again to catch anything the running total missed
+        now = time.time()
+        dir_mtime = os.stat(self.images_dir).st_mtime_ns
+        full_scan = now - self._last_full_scan >= self.clean_time_window
+        if full_scan or dir_mtime != self._dir_mtime:
+            self._dir_mtime = dir_mtime
+            self._scan(full_scan)
+            if full_scan:
+                self._last_full_scan = now
+            return
+        
+        for file_name, (_, mtime) in list(self.files.items()):
+            if now - mtime < self.RECENT_TIME:
+                self._stat_file(file_name)
+    
+    def _scan(self, full_scan: bool):
+        now = time.time()
+        names = set()
+        with os.scandir(self.images_dir) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                names.add(entry.name)
+                known = self.files.get(entry.name)
+                if full_scan or known is None or now - known[1] < self.RECENT_TIME:
+                    self._stat_file(entry.name)
+        
+        for file_name in set(self.files) - names:
+            self._forget_file(file_name)
+    
+    def _stat_file(self, file_name: str):
+        try:
+            stat = os.stat(os.path.join(self.images_dir, file_name))
+        except FileNotFoundError:
+            self._forget_file(file_name)
+            return
+        
+        self._forget_file(file_name)
+        self.files[file_name] = (stat.st_size, stat.st_mtime)
+        self.total_bytes += stat.st_size
+    
+    def _forget_file(self, file_name: str):
+        known = self.files.pop(file_name, None)
+        if known is not None:
+            self.total_bytes -= known[0]
+    
+    def _evict(self):
+        # Oldest files go first and only until the low watermark, deletes are paced so the disk
+        # keeps serving the workers while the sweep runs
+        self.logger.info("High watermark reached with {:.3f}Gb, starting clean".format(self.total_bytes / self.GB))
+        files_erased = 0
+        locked_files = 0
+        size_cleaned = 0
+        delete_interval = 1 / self.max_deletes_per_second if self.max_deletes_per_second > 0 else 0
+        for file_name, (size, _) in sorted(self.files.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= self.low_watermark_bytes or not self.running:
+                break
+            if file_name.endswith(".lock") or self._file_is_locked(file_name):
+                locked_files += 1
+                continue
+            
+            try:
+                os.remove(os.path.join(self.images_dir, file_name))
+                files_erased += 1
+                size_cleaned += size
+            except FileNotFoundError:
+                pass
+            except OSError as ex:
+                self.logger.warning(f"Couldn't remove {file_name}: {ex}")
+                continue
+            self._forget_file(file_name)
+            if delete_interval:
+                time.sleep(delete_interval)
+        
+        if self.metrics is not None:
+            self.metrics.inc("images_cleaned_files_total", files_erased)
+            self.metrics.inc("images_cleaned_bytes_total", size_cleaned)
+            self.metrics.set_gauge("images_dir_bytes", self.total_bytes)
+            self.metrics.set_gauge("images_dir_files", len(self.files))
+        
+        self.logger.info(
+            "Clean ended successfully with {} files erased ({}Gb), locked files reimained {}".format(
+                files_erased, size_cleaned / self.GB, locked_files
+            )
+        )
+    
     def _file_is_locked(self, file_name: str):
         file_wt_ext = file_name.split(".")[0]
-        return os.path.exists(os.path.join(self.images_dir, file_wt_ext + ".lock"))
+        return file_wt_ext + ".lock" in self.files
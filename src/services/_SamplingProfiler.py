@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+
+
+class SamplingProfiler:
+
+    def __init__(self, log_dir: str, logger: logging.Logger, interval: float = 0.01, max_seconds: float = 300):
+        self.log_dir = log_dir
+        self.logger = logger
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds: float) -> bool:
+        with self._lock:
+            if self.running:
+                self.logger.info("Profiler is already running, ignoring new request")
+                return False
+
+            seconds = min(seconds, self.max_seconds)
+            self.logger.info(f"Starting sampling profiler for {seconds}s")
+            self.thread = threading.Thread(target=self._sample, args=(seconds,))
+            self.thread.daemon = True
+            self.thread.start()
+            return True
+
+    def _sample(self, seconds: float):
+        # Only the stacks are read from the running threads, nothing is hooked into them, so the
+        # cost is one walk of every stack per interval on this thread
+        stacks = Counter()
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while time.monotonic() < deadline:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+
+            samples += 1
+            time.sleep(self.interval)
+
+        file_path = os.path.join(self.log_dir, "profile-{}.folded".format(time.strftime("%Y%m%d-%H%M%S")))
+        try:
+            with open(file_path, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            self.logger.info(f"Profile with {samples} samples written to {file_path}")
+        except OSError as ex:
+            self.logger.exception(ex)
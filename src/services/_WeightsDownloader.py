@@ -0,0 +1,114 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import requests
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class WeightsDownloader:
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, logger: logging.Logger, weights_dir: str, max_workers: int, timeout: float = 60) -> None:
+        self.logger = logger
+        self.weights_dir = weights_dir
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def download_all(self, weights: list) -> bool:
+        total = len(weights)
+        succeeded = True
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.download, weight): weight for weight in weights}
+            for index, future in enumerate(as_completed(futures)):
+                weight = futures[future]
+                try:
+                    future.result()
+                    self.logger.info("{} weight downloaded! [{}/{}]".format(weight["name"], index + 1, total))
+                except Exception as ex:
+                    succeeded = False
+                    self.logger.exception(ex)
+
+        return succeeded
+
+    def get_file_path(self, weight: dict) -> str:
+        return os.path.join(self.weights_dir, "{}.{}".format(weight["name"], weight["fileType"]))
+
+    def download(self, weight: dict) -> str:
+        file_path = self.get_file_path(weight)
+        checksum = weight.get("sha256")
+        if os.path.exists(file_path):
+            if self._is_valid(file_path, checksum):
+                self.logger.info("Weight {} already downloaded it, skipping...".format(weight["name"]))
+                return file_path
+
+            self.logger.warning("Weight {} doesn't match its sha256, downloading again".format(weight["name"]))
+            os.remove(file_path)
+
+        self.logger.info("Starting to download {}".format(weight["name"]))
+        url = weight["url"]
+        if weight.get("requestType", "fileTransfer") == "signedRequest":
+            self.logger.info("Url pre assigned found, sending request to get file url")
+            url = self.request_file_url(url)
+
+        # The file only gets its final name once it is complete, so an interrupted download is
+        # resumed from the .partial file instead of being taken as a valid weight
+        partial_path = file_path + ".partial"
+        self._download_file(url, partial_path)
+        if not self._is_valid(partial_path, checksum):
+            os.remove(partial_path)
+            raise Exception("Weight {} downloaded doesn't match sha256 {}".format(weight["name"], checksum))
+
+        os.replace(partial_path, file_path)
+        return file_path
+
+    def request_file_url(self, signed_url: str) -> str:
+        response = requests.get(signed_url, timeout=self.timeout)
+        if response.status_code == 200:
+            self.logger.info("Weights file url got successfully, starting download")
+            data = json.loads(response.content.decode())
+
+            return data["body"]
+
+        raise Exception(f"Invalid url {signed_url}, replied with status code {response.status_code}")
+
+    def _download_file(self, url: str, partial_path: str):
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        request = urllib.request.Request(url)
+        if offset:
+            self.logger.info(f"Resuming download of {partial_path} from byte {offset}")
+            request.add_header("Range", f"bytes={offset}-")
+
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as ex:
+            if not offset or ex.code != 416:
+                raise
+            # Nothing left to download only when the remote file is as long as the partial one,
+            # a longer partial file is from another version and starts again from zero
+            total = ex.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit() and int(total) == offset:
+                return
+            self.logger.warning(f"{partial_path} doesn't match the remote file size {total or 'unknown'}, downloading again")
+            os.remove(partial_path)
+            self._download_file(url, partial_path)
+            return
+
+        with response:
+            mode = "ab" if offset and response.status == 206 else "wb"
+            with open(partial_path, mode) as out:
+                shutil.copyfileobj(response, out, self.CHUNK_SIZE)
+
+    def _is_valid(self, file_path: str, checksum: str) -> bool:
+        if not checksum:
+            return True
+
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b""):
+                digest.update(chunk)
+
+        return digest.hexdigest() == checksum.lower()
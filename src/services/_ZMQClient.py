@@ -1,27 +1,51 @@
 import zmq
+import json
 import logging
 import threading
 
-from ..handlers import BlockSystemHandler
+from ..handlers import BlockSystemHandler, ModelReloadHandler
+from ._SamplingProfiler import SamplingProfiler
 
 
 class ZMQClient:
-    def __init__(self, worker_name: str, block_system: BlockSystemHandler, logger: logging.Logger):
+    def __init__(
+            self,
+            worker_name: str,
+            block_system: BlockSystemHandler,
+            logger: logging.Logger,
+            profiler: SamplingProfiler = None,
+            stats_provider=None,
+            heartbeat_interval: float = 5,
+            reload_handler: ModelReloadHandler = None
+    ):
         self.worker_name = worker_name
         self.block_system = block_system
+        self.profiler = profiler
+        self.stats_provider = stats_provider
+        self.heartbeat_interval = heartbeat_interval
+        self.reload_handler = reload_handler
+        self.reloads = {}
+        self._stopped = threading.Event()
         self.logger = logger
         self.context = zmq.Context()
         self.running = False
         self.sub_socket = None
     
     def start_listen(self):
+        self.running = True
         th = threading.Thread(target=self._listen)
         th.daemon = True
         th.start()
+        if self.stats_provider is not None:
+            th = threading.Thread(target=self._send_heartbeats)
+            th.daemon = True
+            th.start()
     
     def stop_listen(self):
         self.running = False
-        self.sub_socket.close()
+        self._stopped.set()
+        # Terminating the context wakes the listener, which closes its own socket since zmq
+        # sockets can't be closed from another thread
         self.context.term()
     
     def send_message(self, message: str):
@@ -32,8 +56,73 @@ class ZMQClient:
         dealer_socket.send_multipart([self.worker_name.encode(), message.encode()])
         dealer_socket.close()
     
+    def get_workers(self, timeout: float = 2) -> dict:
+        # The master keeps the last heartbeat of every worker, so any worker can answer for all
+        return self._request("GET_WORKERS", timeout)
+    
+    def get_reload(self, reload_id: str, timeout: float = 2) -> dict:
+        return self._request(f"GET_RELOAD:{reload_id}", timeout)
+    
+    def reload(self, reload_id: str, model_key: str, weights_file: str):
+        # This worker reloads right away and skips its own broadcast, so a worker started
+        # without the master reloads too
+        payload = {"id": reload_id, "model": model_key, "weights": weights_file, "origin": self.worker_name}
+        self._start_reload(payload)
+        self.send_message("RELOAD:" + json.dumps(payload))
+    
+    def send_reload_ack(self, reload_id: str, model_key: str, weights_file: str, status: str, error: str = None):
+        ack = {"id": reload_id, "model": model_key, "weights": weights_file, "status": status, "error": error}
+        self.reloads[reload_id] = ack
+        self.send_message("RELOAD_ACK:" + json.dumps(ack))
+    
+    def _request(self, message: str, timeout: float) -> dict:
+        dealer_socket = self.context.socket(zmq.DEALER)
+        dealer_socket.setsockopt(zmq.LINGER, 0)
+        try:
+            dealer_socket.connect("tcp://localhost:5555")
+            dealer_socket.send_multipart([self.worker_name.encode(), message.encode()])
+            if not dealer_socket.poll(timeout * 1000):
+                return None
+            
+            return json.loads(dealer_socket.recv())
+        finally:
+            dealer_socket.close()
+    
+    def _start_reload(self, payload: dict):
+        th = threading.Thread(target=self._reload, args=(payload,))
+        th.daemon = True
+        th.start()
+    
+    def _reload(self, payload: dict):
+        reload_id, model_key, weights_file = payload["id"], payload["model"], payload["weights"]
+        self.send_reload_ack(reload_id, model_key, weights_file, "loading")
+        try:
+            self.reload_handler.reload(model_key, weights_file)
+            self.send_reload_ack(reload_id, model_key, weights_file, "done")
+        except Exception as ex:
+            self.logger.exception(str(ex))
+            self.send_reload_ack(reload_id, model_key, weights_file, "failed", getattr(ex, "message", str(ex)))
+    
+    def _send_heartbeats(self):
+        dealer_socket = self.context.socket(zmq.DEALER)
+        dealer_socket.setsockopt(zmq.LINGER, 0)
+        dealer_socket.setsockopt(zmq.SNDHWM, 1)
+        dealer_socket.connect("tcp://localhost:5555")
+        while self.running:
+            try:
+                message = "HEARTBEAT:" + json.dumps(self.stats_provider())
+                dealer_socket.send_multipart([self.worker_name.encode(), message.encode()], flags=zmq.NOBLOCK)
+            except zmq.error.Again:
+                pass
+            except zmq.error.ContextTerminated:
+                break
+            except Exception as ex:
+                self.logger.exception(str(ex))
+            self._stopped.wait(self.heartbeat_interval)
+        
+        dealer_socket.close()
+    
     def _listen(self):
-        self.running = True
         # Cria um socket SUB para receber mensagens do servidor
         self.sub_socket = self.context.socket(zmq.SUB)
         self.sub_socket.connect("tcp://localhost:5556")
@@ -47,7 +136,17 @@ class ZMQClient:
                     self.logger.info("BLOCK_SYSTEM message received, starting to block worker")
                     self.block_system.block()
                     self.logger.info("Worker is now blocked")
+                elif msg.startswith("PROFILE:") and self.profiler is not None:
+                    self.logger.info(f"{msg} message received, starting profiler")
+                    self.profiler.start(float(msg.split(":", 1)[1]))
+                elif msg.startswith("RELOAD:") and self.reload_handler is not None:
+                    payload = json.loads(msg.split(":", 1)[1])
+                    if payload["origin"] != self.worker_name:
+                        self.logger.info(f"RELOAD message received, reloading model {payload['model']}")
+                        self._start_reload(payload)
             except zmq.error.ContextTerminated:
                 break
             except Exception as ex:
                 self.logger.exception(str(ex))
+        
+        self.sub_socket.close()
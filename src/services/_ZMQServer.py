@@ -1,11 +1,22 @@
 import zmq
+import json
+import time
 import logging
 import threading
 
 
 class ZMQServer:
-    def __init__(self, logger: logging.Logger):
+    HEARTBEAT = b"HEARTBEAT:"
+    GET_WORKERS = b"GET_WORKERS"
+    RELOAD_ACK = b"RELOAD_ACK:"
+    GET_RELOAD = b"GET_RELOAD:"
+    MAX_RELOADS = 100
+
+    def __init__(self, logger: logging.Logger, heartbeat_timeout: float = 15):
         self.logger = logger
+        self.heartbeat_timeout = heartbeat_timeout
+        self.workers = {}
+        self.reloads = {}
         self.running = False
         self.context = zmq.Context()
         self.router_socket = None
@@ -37,11 +48,76 @@ class ZMQServer:
         
         while self.running:
             try:
-                _, identity, msg = self.router_socket.recv_multipart()
+                routing_id, identity, msg = self.router_socket.recv_multipart()
+                if msg.startswith(self.HEARTBEAT):
+                    self.workers[identity.decode()] = {
+                        **json.loads(msg[len(self.HEARTBEAT):]),
+                        "lastSeen": time.time(),
+                    }
+                    continue
+                if msg == self.GET_WORKERS:
+                    self.router_socket.send_multipart([routing_id, json.dumps(self.get_workers()).encode()])
+                    continue
+                if msg.startswith(self.RELOAD_ACK):
+                    self._store_reload_ack(identity.decode(), json.loads(msg[len(self.RELOAD_ACK):]))
+                    continue
+                if msg.startswith(self.GET_RELOAD):
+                    reload_status = self.get_reload(msg[len(self.GET_RELOAD):].decode())
+                    self.router_socket.send_multipart([routing_id, json.dumps(reload_status).encode()])
+                    continue
+                
                 self.logger.info(f"Message received from {identity.decode()}: {msg.decode()}, sending for all workers")
-                self.pub_socket.send_string(msg)
+                self.pub_socket.send(msg)
                 self.logger.info("Message published successfully!")
             except zmq.error.ContextTerminated:
                 break
             except Exception as ex:
-                self.logger.exception(str(ex))
\ No newline at end of file
+                self.logger.exception(str(ex))
+    
+    def get_workers(self) -> dict:
+        # A worker that missed its heartbeats is dead, whatever the process table says
+        now = time.time()
+        workers = {}
+        for name, stats in self.workers.items():
+            alive = now - stats["lastSeen"] <= self.heartbeat_timeout
+            workers[name] = {**stats, "status": stats.get("status", "running") if alive else "dead"}
+        
+        return workers
+    
+    def get_reload(self, reload_id: str) -> dict:
+        reload = self.reloads.get(reload_id)
+        if reload is None:
+            return {}
+        
+        # Converged once every live worker acked the new weights, workers started after the
+        # reload report them in their heartbeats without acking
+        workers = {}
+        known_workers = self.get_workers()
+        for name, stats in known_workers.items():
+            if stats["status"] == "dead":
+                continue
+            ack = reload["acks"].get(name)
+            if ack is None and stats.get("weights", {}).get(reload["model"], "").endswith("/" + reload["weights"]):
+                ack = {"status": "done", "error": None}
+            workers[name] = ack or {"status": "pending", "error": None}
+        for name, ack in reload["acks"].items():
+            if name not in known_workers:
+                workers[name] = ack
+        
+        statuses = [worker["status"] for worker in workers.values()]
+        if "failed" in statuses:
+            status = "failed"
+        elif statuses and all(status == "done" for status in statuses):
+            status = "done"
+        else:
+            status = "running"
+        
+        return {"id": reload_id, "model": reload["model"], "weights": reload["weights"], "status": status, "workers": workers}
+    
+    def _store_reload_ack(self, worker_name: str, ack: dict):
+        reload = self.reloads.get(ack["id"])
+        if reload is None:
+            if len(self.reloads) >= self.MAX_RELOADS:
+                del self.reloads[next(iter(self.reloads))]
+            reload = self.reloads[ack["id"]] = {"model": ack["model"], "weights": ack["weights"], "acks": {}}
+        reload["acks"][worker_name] = {"status": ack["status"], "error": ack["error"], "time": time.time()}
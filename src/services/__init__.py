@@ -1,3 +1,9 @@
 from ._MemoryCleanService import MemoryCleanService
 from ._ZMQServer import ZMQServer
 from ._ZMQClient import ZMQClient
+from ._DetectionBatcher import DetectionBatcher
+from ._InferenceClient import InferenceClient
+from ._InferenceServer import InferenceServer
+from ._WeightsDownloader import WeightsDownloader
+from ._JobService import JobService
+from ._SamplingProfiler import SamplingProfiler
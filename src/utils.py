@@ -1,4 +1,14 @@
+import json
+import time
+import base64
+import numpy as np
 from functools import wraps
+from flask import Response, request
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 
 def handle_exception(success_code=200, unknow_error_code=500):
@@ -19,3 +29,74 @@ def handle_exception(success_code=200, unknow_error_code=500):
         return wrapper
     
     return decorator
+
+
+def negotiate_content():
+    # Clients that accept application/msgpack get a binary body with the bitmap masks as raw bytes,
+    # JSON clients get them in base64.
+    # Requests with the X-Request-Timing header get their stage durations in the body and in
+    # the Server-Timing header
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = getattr(args[0], "metrics", None)
+            tracing = metrics is not None and request.headers.get("X-Request-Timing", "0").lower() not in ("", "0", "false")
+            if tracing:
+                metrics.start_trace()
+            
+            start_time = time.perf_counter()
+            try:
+                data, code = func(*args, **kwargs)
+            finally:
+                timings = metrics.stop_trace() if tracing else None
+            
+            if timings is not None:
+                timings["total"] = time.perf_counter() - start_time
+                data["timings"] = {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+            
+            start_time = time.perf_counter()
+            if msgpack is not None and \
+                    request.accept_mimetypes.best_match(["application/json", "application/msgpack"]) == "application/msgpack":
+                response = Response(msgpack.packb(data), status=code, mimetype="application/msgpack")
+            else:
+                response = Response(json.dumps(data, default=encode_bytes), status=code, mimetype="application/json")
+            if metrics is not None:
+                metrics.observe("serialize", time.perf_counter() - start_time)
+            if timings is not None:
+                timings["serialize"] = time.perf_counter() - start_time
+                response.headers["Server-Timing"] = ", ".join(
+                    "{};dur={:.3f}".format(stage, seconds * 1000) for stage, seconds in timings.items()
+                )
+            
+            return response
+        
+        return wrapper
+    
+    return decorator
+
+
+def encode_bytes(value):
+    # json.dumps default for the raw buffers of the bitmap masks
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode()
+    
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def pack_arrays(arrays: list):
+    # Arrays travel as raw buffers next to a small header, so ZMQ can send them without copies
+    headers = []
+    frames = []
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        headers.append({"dtype": str(array.dtype), "shape": list(array.shape)})
+        frames.append(memoryview(array).cast("B") if array.size else b"")
+    
+    return headers, frames
+
+
+def unpack_arrays(headers: list, frames: list) -> list:
+    return [
+        np.frombuffer(frame, dtype=header["dtype"]).reshape(header["shape"])
+        for header, frame in zip(headers, frames)
+    ]